@@ -36,12 +36,13 @@ import sys
 import time
 from glob import glob
 from itertools import combinations
-from itertools import product as combinations_product
-from collections import defaultdict
+from collections import defaultdict, Counter
 from multiprocessing import Pool, cpu_count, get_context
+from multiprocessing.pool import ThreadPool
 from argparse import ArgumentParser
 from difflib import SequenceMatcher
 from operator import itemgetter
+from functools import wraps
 import zipfile
 
 from Bio import SeqIO
@@ -49,7 +50,6 @@ from Bio import SeqIO
 # from Bio import AlignIO
 # from Bio import pairwise2
 # from Bio.SubsMat.MatrixInfo import pam250 as scoring_matrix
-from Bio import Phylo
 
 from functions import *
 from ArrowerSVG import *
@@ -59,10 +59,15 @@ from array import array
 from scipy.optimize import linear_sum_assignment
 import json
 import shutil
-from distutils import dir_util
-from sklearn.cluster import AffinityPropagation
 import networkx as nx
 
+# pyhmmer is optional: if it is not available, domain prediction falls back to
+# calling the hmmscan executable
+try:
+    import pyhmmer
+except ImportError:
+    pyhmmer = None
+
 
 global use_relevant_mibig
 global mibig_set
@@ -92,306 +97,314 @@ def process_gbk_files(gbk, min_bgc_size, bgc_info, files_no_proteins, files_no_b
     # (Currently) we have to open the file anyway to read all its 
     # properties for bgc_info anyway...
     outputfile = os.path.join(bgc_fasta_folder, clusterName + '.fasta')
-    if os.path.isfile(outputfile) and os.path.getsize(outputfile) > 0 and not force_hmmscan:
+    if is_non_empty_file(outputfile) and not force_hmmscan:
         if verbose:
             print(" File {} already processed".format(outputfile))
         save_fasta = False
     else:
         save_fasta = True
     
-    try:
-        # basic file verification. Substitutes check_data_integrity
-        records = list(SeqIO.parse(gbk, "genbank"))
-    except ValueError as e:
-        print("   Error with file {}: \n    '{}'".format(gbk, str(e)))
-        print("    (This file will be excluded from the analysis)")
-        return
-    else:
-        total_seq_length = 0
-        bgc_size = 0
-        cds_ctr = 0
-        product = "no type"
-        offset_record_position = 0
-        
-        max_width = 0 # This will be used for the SVG figure
-        record_count = 0
-        
-        for record in records:
-            record_count += 1
-            bgc_size += len(record.seq)
-            if len(record.seq) > max_width:
-                max_width = len(record.seq)
-            
-            for feature in record.features:
-                # antiSMASH <= 4
-                if feature.type == "cluster":
-                    if "product" in feature.qualifiers:
-                        # in antiSMASH 4 there should only be 1 product qualifiers
-                        for product in feature.qualifiers["product"]:
-                            for p in product.replace(" ","").split("-"):
-                                product_list_per_record.append(p)
-                                
-                    if "contig_edge" in feature.qualifiers:
-                        # there might be mixed contig_edge annotations
-                        # in multi-record files. Turn on contig_edge when
-                        # there's at least one annotation
-                        if feature.qualifiers["contig_edge"][0] == "True":
-                            if verbose:
-                                print(" Contig edge detected in {}".format(fname))
-                            contig_edge = True
-                        
-                # antiSMASH = 5
-                if "region" in feature.type:
-                    if "product" in feature.qualifiers:
-                        for product in feature.qualifiers["product"]:
-                            product_list_per_record.append(product)
-                            
-                    if "contig_edge" in feature.qualifiers:
-                        # there might be mixed contig_edge annotations
-                        # in multi-record files. Turn on contig_edge when
-                        # there's at least one annotation
-                        if feature.qualifiers["contig_edge"][0] == "True":
-                            if verbose:
-                                print(" Contig edge detected in {}".format(fname))
-                            contig_edge = True
+    # basic file verification. Substitutes check_data_integrity
+    # Records are streamed (only the first one is kept, for its metadata)
+    # so parsing errors are caught as they come up
+    total_seq_length = 0
+    bgc_size = 0
+    cds_ctr = 0
+    product = "no type"
+    offset_record_position = 0
+    
+    max_width = 0 # This will be used for the SVG figure
+    record_count = 0
+    first_record = None
+    
+    records = SeqIO.parse(gbk, "genbank")
+    while True:
+        try:
+            record = next(records)
+        except StopIteration:
+            break
+        except ValueError as e:
+            print("   Error with file {}: \n    '{}'".format(gbk, str(e)))
+            print("    (This file will be excluded from the analysis)")
+            return
+        
+        if first_record is None:
+            first_record = record
+        record_count += 1
+        bgc_size += len(record.seq)
+        if len(record.seq) > max_width:
+            max_width = len(record.seq)
+        
+        for feature in record.features:
+            qualifiers = feature.qualifiers
+            # antiSMASH <= 4
+            if feature.type == "cluster":
+                if "product" in qualifiers:
+                    # in antiSMASH 4 there should only be 1 product qualifiers
+                    for product in qualifiers["product"]:
+                        for p in product.replace(" ","").split("-"):
+                            product_list_per_record.append(p)
                             
-                        
-                # Get biosynthetic genes + sequences
-                if feature.type == "CDS":
-                    cds_ctr += 1
-                    CDS = feature
+                if "contig_edge" in qualifiers:
+                    # there might be mixed contig_edge annotations
+                    # in multi-record files. Turn on contig_edge when
+                    # there's at least one annotation
+                    if qualifiers["contig_edge"][0] == "True":
+                        if verbose:
+                            print(" Contig edge detected in {}".format(fname))
+                        contig_edge = True
                     
-                    gene_id = ""
-                    if "gene" in CDS.qualifiers:
-                        gene_id = CDS.qualifiers.get('gene',"")[0]
+            # antiSMASH = 5
+            if "region" in feature.type:
+                if "product" in qualifiers:
+                    for product in qualifiers["product"]:
+                        product_list_per_record.append(product)
+                        
+                if "contig_edge" in qualifiers:
+                    # there might be mixed contig_edge annotations
+                    # in multi-record files. Turn on contig_edge when
+                    # there's at least one annotation
+                    if qualifiers["contig_edge"][0] == "True":
+                        if verbose:
+                            print(" Contig edge detected in {}".format(fname))
+                        contig_edge = True
                         
                     
-                    protein_id = ""
-                    if "protein_id" in CDS.qualifiers:
-                        protein_id = CDS.qualifiers.get('protein_id',"")[0]
+            # Get biosynthetic genes + sequences
+            if feature.type == "CDS":
+                cds_ctr += 1
+                CDS = feature
+                
+                gene_id = ""
+                if "gene" in qualifiers:
+                    gene_id = qualifiers['gene'][0]
                     
-                    # nofuzzy_start/nofuzzy_end are obsolete
-                    # http://biopython.org/DIST/docs/api/Bio.SeqFeature.FeatureLocation-class.html#nofuzzy_start
-                    gene_start = offset_record_position + max(0, int(CDS.location.start))
-                    gene_end = offset_record_position + max(0, int(CDS.location.end))
-                    record_end = gene_end
+                
+                protein_id = ""
+                if "protein_id" in qualifiers:
+                    protein_id = qualifiers['protein_id'][0]
+                
+                # nofuzzy_start/nofuzzy_end are obsolete
+                # http://biopython.org/DIST/docs/api/Bio.SeqFeature.FeatureLocation-class.html#nofuzzy_start
+                gene_start = offset_record_position + max(0, int(CDS.location.start))
+                gene_end = offset_record_position + max(0, int(CDS.location.end))
+                record_end = gene_end
+                
+                direction = CDS.location.strand
+                if direction == 1:
+                    strand = '+'
+                else:
+                    strand = '-'
                     
-                    direction = CDS.location.strand
-                    if direction == 1:
-                        strand = '+'
-                    else:
-                        strand = '-'
-                        
-                    fasta_header = "{}_ORF{}:gid:{}:pid:{}:loc:{}:{}:strand:{}".format(clusterName, str(cds_ctr), str(gene_id).replace(":","_"), str(protein_id).replace(":","_"), str(gene_start), str(gene_end), strand)
-                    fasta_header = fasta_header.replace(">","") #the coordinates might contain larger than signs, tools upstream don't like this
-                    fasta_header = fasta_header.replace(" ", "") #the domtable output format (hmmscan) uses spaces as a delimiter, so these cannot be present in the fasta header
-
-                    # antiSMASH <=4
-                    if "sec_met" in feature.qualifiers:
-                        if "Kind: biosynthetic" in feature.qualifiers["sec_met"]:
-                            biosynthetic_genes.add(fasta_header)
-
-                    # antiSMASH == 5
-                    if "gene_kind" in feature.qualifiers:
-                        if "biosynthetic" in feature.qualifiers["gene_kind"]:
-                            biosynthetic_genes.add(fasta_header)
+                fasta_header = "{}_ORF{}:gid:{}:pid:{}:loc:{}:{}:strand:{}".format(clusterName, str(cds_ctr), str(gene_id).replace(":","_"), str(protein_id).replace(":","_"), str(gene_start), str(gene_end), strand)
+                fasta_header = fasta_header.replace(">","") #the coordinates might contain larger than signs, tools upstream don't like this
+                fasta_header = fasta_header.replace(" ", "") #the domtable output format (hmmscan) uses spaces as a delimiter, so these cannot be present in the fasta header
+
+                # antiSMASH <=4
+                if "sec_met" in qualifiers:
+                    if "Kind: biosynthetic" in qualifiers["sec_met"]:
+                        biosynthetic_genes.add(fasta_header)
+
+                # antiSMASH == 5
+                if "gene_kind" in qualifiers:
+                    if "biosynthetic" in qualifiers["gene_kind"]:
+                        biosynthetic_genes.add(fasta_header)
+                
+                fasta_header = ">"+fasta_header
+                
+
+                if 'translation' in qualifiers:
+                    prot_seq = qualifiers['translation'][0]
+                # If translation isn't available translate manually, this will take longer
+                else:
+                    nt_seq = CDS.location.extract(record.seq)
                     
-                    fasta_header = ">"+fasta_header
+                    # If we know sequence is an ORF (like all CDSs), codon table can be
+                    #  used to correctly translate alternative start codons.
+                    #  see http://biopython.org/DIST/docs/tutorial/Tutorial.html#htoc25
+                    # If the sequence has a fuzzy start/end, it might not be complete,
+                    # (therefore it might not be the true start codon)
+                    # However, in this case, if 'translation' not available, assume 
+                    #  this is just a random sequence 
+                    complete_cds = False 
                     
-
-                    if 'translation' in CDS.qualifiers.keys():
-                        prot_seq = CDS.qualifiers['translation'][0]
-                    # If translation isn't available translate manually, this will take longer
-                    else:
-                        nt_seq = CDS.location.extract(record.seq)
-                        
-                        # If we know sequence is an ORF (like all CDSs), codon table can be
-                        #  used to correctly translate alternative start codons.
-                        #  see http://biopython.org/DIST/docs/tutorial/Tutorial.html#htoc25
-                        # If the sequence has a fuzzy start/end, it might not be complete,
-                        # (therefore it might not be the true start codon)
-                        # However, in this case, if 'translation' not available, assume 
-                        #  this is just a random sequence 
-                        complete_cds = False 
+                    # More about fuzzy positions
+                    # http://biopython.org/DIST/docs/tutorial/Tutorial.html#htoc39
+                    fuzzy_start = False 
+                    if str(CDS.location.start)[0] in "<>":
+                        complete_cds = False
+                        fuzzy_start = True
                         
-                        # More about fuzzy positions
-                        # http://biopython.org/DIST/docs/tutorial/Tutorial.html#htoc39
-                        fuzzy_start = False 
-                        if str(CDS.location.start)[0] in "<>":
-                            complete_cds = False
-                            fuzzy_start = True
-                            
-                        fuzzy_end = False
-                        if str(CDS.location.end)[0] in "<>":
-                            fuzzy_end = True
+                    fuzzy_end = False
+                    if str(CDS.location.end)[0] in "<>":
+                        fuzzy_end = True
+                    
+                    #for protein sequence if it is at the start of the entry assume 
+                    # that end of sequence is in frame and trim from the beginning
+                    #if it is at the end of the genbank entry assume that the start 
+                    # of the sequence is in frame
+                    reminder = len(nt_seq)%3
+                    if reminder > 0:
+                        if fuzzy_start and fuzzy_end:
+                            print("Warning, CDS ({}, {}) has fuzzy\
+                                start and end positions, and a \
+                                sequence length not multiple of \
+                                three. Skipping".format(clusterName, 
+                                qualifiers.get('locus_tag',"")[0]))
+                            break
                         
-                        #for protein sequence if it is at the start of the entry assume 
-                        # that end of sequence is in frame and trim from the beginning
-                        #if it is at the end of the genbank entry assume that the start 
-                        # of the sequence is in frame
-                        reminder = len(nt_seq)%3
-                        if reminder > 0:
-                            if fuzzy_start and fuzzy_end:
-                                print("Warning, CDS ({}, {}) has fuzzy\
-                                    start and end positions, and a \
-                                    sequence length not multiple of \
-                                    three. Skipping".format(clusterName, 
-                                    CDS.qualifiers.get('locus_tag',"")[0]))
-                                break
-                            
-                            if fuzzy_start:
-                                if reminder == 1:
-                                    nt_seq = nt_seq[1:]
-                                else:
-                                    nt_seq = nt_seq[2:]
-                            # fuzzy end
+                        if fuzzy_start:
+                            if reminder == 1:
+                                nt_seq = nt_seq[1:]
                             else:
-                                #same logic reverse direction
-                                if reminder == 1:
-                                    nt_seq = nt_seq[:-1]
-                                else:
-                                    nt_seq = nt_seq[:-2]
-                        
-                        # The Genetic Codes: www.ncbi.nlm.nih.gov/Taxonomy/Utils/wprintgc.cgi
-                        if "transl_table" in CDS.qualifiers.keys():
-                            CDStable = CDS.qualifiers.get("transl_table", "")[0]
-                            prot_seq = str(nt_seq.translate(table=CDStable, to_stop=True, cds=complete_cds))
+                                nt_seq = nt_seq[2:]
+                        # fuzzy end
                         else:
-                            prot_seq = str(nt_seq.translate(to_stop=True, cds=complete_cds))
-                            
-                    total_seq_length += len(prot_seq)
-                
-                
-                    bgc_locus_tags.append(fasta_header)
-                    locus_sequences[fasta_header] = prot_seq
-                    locus_coordinates[fasta_header] = (gene_start, gene_end, len(prot_seq))
+                            #same logic reverse direction
+                            if reminder == 1:
+                                nt_seq = nt_seq[:-1]
+                            else:
+                                nt_seq = nt_seq[:-2]
                     
-
-            # TODO: if len(biosynthetic_genes) == 0, traverse record again
-            # and add CDS with genes that contain domains labeled sec_met
-            # we'll probably have to have a list of domains if we allow
-            # fasta files as input
-            
-            # make absolute positions for ORFs in next records
-            offset_record_position += record_end + 100
-        
-        if bgc_size > min_bgc_size:  # exclude the bgc if it's too small
-            # check what we have product-wise
-            # In particular, handle different products for multi-record files
-            product_set = set(product_list_per_record)
-            if len(product_set) == 1: # only one type of product
-                product = product_list_per_record[0]
-            elif "other" in product_set: # more than one, and it contains "other"
-                if len(product_set) == 2:
-                    product = list(product_set - {'other'})[0] # product = not "other"
-                else:
-                    product = ".".join(product_set - {'other'}) # likely a hybrid
-            else:
-                product = ".".join(product_set) # likely a hybrid
-                
-            # Don't keep this bgc if its type not in valid classes specified by user
-            # This will avoid redundant tasks like domain detection
-            subproduct = set()
-            for p in product.split("."):
-                subproduct.add(sort_bgc(p).lower())
-            if "nrps" in subproduct and ("pksi" in subproduct or "pksother" in subproduct):
-                subproduct.add("pks-nrp_hybrids")
+                    # The Genetic Codes: www.ncbi.nlm.nih.gov/Taxonomy/Utils/wprintgc.cgi
+                    if "transl_table" in qualifiers:
+                        CDStable = qualifiers.get("transl_table", "")[0]
+                        prot_seq = str(nt_seq.translate(table=CDStable, to_stop=True, cds=complete_cds))
+                    else:
+                        prot_seq = str(nt_seq.translate(to_stop=True, cds=complete_cds))
+                        
+                total_seq_length += len(prot_seq)
+            
+            
+                bgc_locus_tags.append(fasta_header)
+                locus_sequences[fasta_header] = prot_seq
+                locus_coordinates[fasta_header] = (gene_start, gene_end, len(prot_seq))
                 
-            if len(valid_classes & subproduct) == 0:
-                if verbose:
-                    print(" Skipping {} (type: {})".format(clusterName, product))
-                return False
-            
-            # assuming that the definition field is the same in all records
-            # product: antiSMASH predicted class of metabolite
-            # gbk definition
-            # number of records (for Arrower figures)
-            # max_width: width of the largest record (for Arrower figures)
-            # id: the GenBank's accession
-            #bgc_info[clusterName] = (product, records[0].description, len(records), max_width, records[0].id, biosynthetic_genes.copy())
-            # TODO contig_edge annotation is not present for antiSMASH v < 4
-            # Perhaps we can try to infer if it's in a contig edge: if
-            # - first biosynthetic gene start < 10kb or
-            # - max_width - last biosynthetic gene end < 10kb (but this will work only for the largest record)
-            bgc_info[clusterName] = bgc_data(records[0].id, records[0].description, product, len(records), max_width, bgc_size + (record_count-1)*1000, records[0].annotations["organism"], ",".join(records[0].annotations["taxonomy"]), biosynthetic_genes.copy(), contig_edge)
-
-            if len(bgc_info[clusterName].biosynthetic_genes) == 0:
-                files_no_biosynthetic_genes.append(clusterName+".gbk")
-
-            # TODO why re-process everything if it was already in the list?
-            # if name already in genbankDict.keys -> add file_folder
-            # else: extract all info
-            if clusterName in genbankDict.keys():
-                # Name was already in use. Use file_folder as the new sample's name
-                genbankDict[clusterName][1].add(file_folder) 
+
+        # TODO: if len(biosynthetic_genes) == 0, traverse record again
+        # and add CDS with genes that contain domains labeled sec_met
+        # we'll probably have to have a list of domains if we allow
+        # fasta files as input
+        
+        # make absolute positions for ORFs in next records
+        offset_record_position += record_end + 100
+    if bgc_size > min_bgc_size:  # exclude the bgc if it's too small
+        # check what we have product-wise
+        # In particular, handle different products for multi-record files
+        product_set = set(product_list_per_record)
+        if len(product_set) == 1: # only one type of product
+            product = product_list_per_record[0]
+        elif "other" in product_set: # more than one, and it contains "other"
+            if len(product_set) == 2:
+                product = list(product_set - {'other'})[0] # product = not "other"
             else:
-                # See if we need to write down the sequence
-                if total_seq_length > 0:
-                    # location of first instance of the file is genbankDict[clustername][0]
-                    genbankDict.setdefault(clusterName, [gbk, set([file_folder])])
-
-                    if save_fasta:
-                        # Find overlaps in CDS regions and delete the shortest ones.
-                        # This is thought as a solution for selecting genes with 
-                        # alternate splicing events
-                        # Food for thought: imagine CDS A overlapping CDS B overlapping
-                        # CDS C. If len(A) > len(B) > len(C) and we first compare A vs B
-                        # and delete A, then B vs C and delete B: would that be a better
-                        # solution than removing B? Could this actually happen?
-                        # TODO What if the overlapping CDS is in the reverse strand?
-                        #  maybe it should be kept as it is
-                        # TODO what are the characterized differences in prokarytote
-                        #  vs eukaryote CDS overlap?
-                        del_list = set()
-                        for a, b in combinations(bgc_locus_tags, 2):
-                            a_start, a_end, a_len = locus_coordinates[a]
-                            b_start, b_end, b_len = locus_coordinates[b]
-                            
-                            if b_end <= a_start or b_start >= a_end:
-                                pass
+                product = ".".join(product_set - {'other'}) # likely a hybrid
+        else:
+            product = ".".join(product_set) # likely a hybrid
+            
+        # Don't keep this bgc if its type not in valid classes specified by user
+        # This will avoid redundant tasks like domain detection
+        subproduct = set()
+        for p in product.split("."):
+            subproduct.add(sort_bgc(p).lower())
+        if "nrps" in subproduct and ("pksi" in subproduct or "pksother" in subproduct):
+            subproduct.add("pks-nrp_hybrids")
+            
+        if len(valid_classes & subproduct) == 0:
+            if verbose:
+                print(" Skipping {} (type: {})".format(clusterName, product))
+            return False
+        
+        # assuming that the definition field is the same in all records
+        # product: antiSMASH predicted class of metabolite
+        # gbk definition
+        # number of records (for Arrower figures)
+        # max_width: width of the largest record (for Arrower figures)
+        # id: the GenBank's accession
+        #bgc_info[clusterName] = (product, first_record.description, record_count, max_width, first_record.id, biosynthetic_genes.copy())
+        # TODO contig_edge annotation is not present for antiSMASH v < 4
+        # Perhaps we can try to infer if it's in a contig edge: if
+        # - first biosynthetic gene start < 10kb or
+        # - max_width - last biosynthetic gene end < 10kb (but this will work only for the largest record)
+        bgc_info[clusterName] = bgc_data(first_record.id, first_record.description, product, record_count, max_width, bgc_size + (record_count-1)*1000, first_record.annotations["organism"], ",".join(first_record.annotations["taxonomy"]), biosynthetic_genes.copy(), contig_edge)
+
+        if len(bgc_info[clusterName].biosynthetic_genes) == 0:
+            files_no_biosynthetic_genes.append(clusterName+".gbk")
+
+        # TODO why re-process everything if it was already in the list?
+        # if name already in genbankDict.keys -> add file_folder
+        # else: extract all info
+        if clusterName in genbankDict.keys():
+            # Name was already in use. Use file_folder as the new sample's name
+            genbankDict[clusterName][1].add(file_folder) 
+        else:
+            # See if we need to write down the sequence
+            if total_seq_length > 0:
+                # location of first instance of the file is genbankDict[clustername][0]
+                genbankDict.setdefault(clusterName, [gbk, set([file_folder])])
+
+                if save_fasta:
+                    # Find overlaps in CDS regions and delete the shortest ones.
+                    # This is thought as a solution for selecting genes with 
+                    # alternate splicing events
+                    # Food for thought: imagine CDS A overlapping CDS B overlapping
+                    # CDS C. If len(A) > len(B) > len(C) and we first compare A vs B
+                    # and delete A, then B vs C and delete B: would that be a better
+                    # solution than removing B? Could this actually happen?
+                    # TODO What if the overlapping CDS is in the reverse strand?
+                    #  maybe it should be kept as it is
+                    # TODO what are the characterized differences in prokarytote
+                    #  vs eukaryote CDS overlap?
+                    del_list = set()
+                    for a, b in combinations(bgc_locus_tags, 2):
+                        a_start, a_end, a_len = locus_coordinates[a]
+                        b_start, b_end, b_len = locus_coordinates[b]
+                        
+                        if b_end <= a_start or b_start >= a_end:
+                            pass
+                        else:
+                            # calculate overlap
+                            if a_start > b_start:
+                                ov_start = a_start
                             else:
-                                # calculate overlap
-                                if a_start > b_start:
-                                    ov_start = a_start
-                                else:
-                                    ov_start = b_start
+                                ov_start = b_start
+
+                            if a_end < b_end:
+                                ov_end = a_end
+                            else:
+                                ov_end = b_end
 
-                                if a_end < b_end:
-                                    ov_end = a_end
+                            overlap_length = ov_end - ov_start
+                            
+                            # allow the overlap to be as large as 10% of the
+                            # shortest CDS. Overlap length is in nucleotides
+                            # here, whereas a_len, b_len are protein 
+                            # sequence lengths
+                            if overlap_length/3 > 0.1*min(a_len,b_len):
+                                if a_len > b_len:
+                                    del_list.add(b)
                                 else:
-                                    ov_end = b_end
-
-                                overlap_length = ov_end - ov_start
-                                
-                                # allow the overlap to be as large as 10% of the
-                                # shortest CDS. Overlap length is in nucleotides
-                                # here, whereas a_len, b_len are protein 
-                                # sequence lengths
-                                if overlap_length/3 > 0.1*min(a_len,b_len):
-                                    if a_len > b_len:
-                                        del_list.add(b)
-                                    else:
-                                        del_list.add(a)
-                        
-                        for locus in del_list:
-                            if verbose:
-                                print("   Removing {} because it overlaps with other ORF".format(locus))
-                            bgc_locus_tags.remove(locus)
-                        
-                        with open(outputfile,'w') as fastaHandle:
-                            for locus in bgc_locus_tags:
-                                fastaHandle.write("{}\n".format(locus))
-                                fastaHandle.write("{}\n".format(locus_sequences[locus]))
-                            adding_sequence = True
-                else:
-                    files_no_proteins.append(fname)
+                                    del_list.add(a)
+                    
+                    for locus in del_list:
+                        if verbose:
+                            print("   Removing {} because it overlaps with other ORF".format(locus))
+                        bgc_locus_tags.remove(locus)
+                    
+                    with open(outputfile,'w') as fastaHandle:
+                        for locus in bgc_locus_tags:
+                            fastaHandle.write("{}\n".format(locus))
+                            fastaHandle.write("{}\n".format(locus_sequences[locus]))
+                        adding_sequence = True
+            else:
+                files_no_proteins.append(fname)
+
+        if verbose:
+            print("  Adding {} ({} bps)".format(fname, str(bgc_size)))
+                            
+    else:
+        print(" Discarding {} (size less than {} bp, was {})".format(clusterName, str(min_bgc_size), str(bgc_size)))
 
-            if verbose:
-                print("  Adding {} ({} bps)".format(fname, str(bgc_size)))
-                                
-        else:
-            print(" Discarding {} (size less than {} bp, was {})".format(clusterName, str(min_bgc_size), str(bgc_size)))
-    
     return adding_sequence
 
 
@@ -472,10 +485,11 @@ def timeit(funct):
     - That function its output.
     - Runtime of that function in a file called commands.txt and on screen.
     """
-    def _wrap(*args):
-        start_time = time.time()
-        ret = funct(*args)
-        runtime = time.time()-start_time
+    @wraps(funct)
+    def _wrap(*args, **kwargs):
+        start_time = time.perf_counter()
+        ret = funct(*args, **kwargs)
+        runtime = time.perf_counter()-start_time
         runtime_string = '{} took {:.3f} seconds'.format(funct.__name__, runtime)
         with open(os.path.join(log_folder, "runtimes.txt"), 'a') as timings_file:
             timings_file.write(runtime_string + "\n")
@@ -489,25 +503,55 @@ def timeit(funct):
 def generate_network(cluster_pairs, cores):
     """Distributes the distance calculation part
     cluster_pairs is a list of triads (cluster1_index, cluster2_index, BGC class)
+    Pairs that were already calculated for a previous network are not sent to
+    the workers: their distance is re-weighted for this class. Rows are only
+    kept in network_row_cache while a class network that has not been 
+    generated yet contains both BGCs (see pending_bgc_classes)
     """
     
-    pool = get_context("fork").Pool(cores, maxtasksperchild=100)
-    
-    #Assigns the data to the different workers and pools the results back into
-    # the network_matrix variable
-    network_matrix = pool.map(generate_dist_matrix, cluster_pairs)
+    is_new_pair = [(pair[0], pair[1]) not in network_row_cache for pair in cluster_pairs]
+    new_pairs = [pair for pair, is_new in zip(cluster_pairs, is_new_pair) if is_new]
+    
+    network_matrix = []
+    if len(new_pairs) > 0:
+        pool = get_context("fork").Pool(cores, maxtasksperchild=100)
+
+        #Assigns the data to the different workers and pools the results back into
+        # the network_matrix variable. Pairs are sent in chunks to keep the
+        # inter-process communication overhead low (the workers already have all
+        # the BGC data as they are forked from this process)
+        chunksize = max(1, min(1000, len(new_pairs) // (4*cores)))
+        results = pool.map(generate_dist_matrix, new_pairs, chunksize)
+        pool.close()
+        pool.join()
+        
+        network_matrix = [row for row, raw in results]
+        for row, raw in results:
+            if raw is not None:
+                network_row_cache[(int(row[0]), int(row[1]))] = raw
+        del results[:]
+    
+    if len(new_pairs) < len(cluster_pairs):
+        print("  ({} distances re-used from previous networks)".format(len(cluster_pairs) - len(new_pairs)))
+        new_rows = iter(network_matrix)
+        network_matrix = [next(new_rows) if is_new else 
+            reuse_network_row((pair[0], pair[1]), bgcClassNames[pair[2]])
+            for pair, is_new in zip(cluster_pairs, is_new_pair)]
 
     # --- Serialized version of distance calculation ---
     # For the time being, use this if you have memory issues
     #network_matrix = []
     #for pair in cluster_pairs:
-      #network_matrix.append(generate_dist_matrix(pair))
+      #network_matrix.append(generate_dist_matrix(pair)[0])
 
     return network_matrix
 
 
 def generate_dist_matrix(parms):
-    """Unpack data to actually launch cluster_distance for one pair of BGCs"""
+    """Unpack data to actually launch cluster_distance for one pair of BGCs.
+    Returns the network row and, if a class network still to be generated
+    needs this pair (see generate_network), the values to re-weight it later.
+    Otherwise None"""
     
     cluster1Idx,cluster2Idx,bgcClassIdx = [int(parm) for parm in parms]
     cluster1 = clusterNames[cluster1Idx]
@@ -531,7 +575,7 @@ def generate_dist_matrix(parms):
         print("   Warning: Regarding distance between clusters {} and {}:".format(cluster1, cluster2))
         if len(domain_list_A) == 0 and len(domain_list_B) == 0:
             print("   None have identified domains. Distance cannot be calculated")
-        elif (domain_list_A) == 0:
+        elif len(domain_list_A) == 0:
             print("   Cluster {} has no identified domains. Distance set to 1".format(cluster1))
         else:
             print("   Cluster {} has no identified domains. Distance set to 1".format(cluster2))
@@ -541,7 +585,7 @@ def generate_dist_matrix(parms):
 
         # cluster1Idx, cluster2Idx, distance, jaccard, DSS, AI, rDSSNa, rDSSa, 
         #   S, Sa, lcsStartA, lcsStartB
-        return array('f',[cluster1Idx,cluster2Idx,1,0,0,0,0,0,1,1,0,0])
+        return array('f',[cluster1Idx,cluster2Idx,1,0,0,0,0,0,1,1,0,0]), None
     
     # "Domain Count per Gene". List of simple labels (integers) indicating number
     # of domains belonging to each gene
@@ -558,12 +602,24 @@ def generate_dist_matrix(parms):
     go_a = BGCGeneOrientation[cluster1]
     go_b = BGCGeneOrientation[cluster2]
     
-    dist, jaccard, dss, ai, rDSSna, rDSS, S, Sa, lcsStartA, lcsStartB, seedLength, reverse = cluster_distance_lcs(cluster1, cluster2, domain_list_A,
-        domain_list_B, dcg_a, dcg_b, core_pos_a, core_pos_b, go_a, go_b, bgc_class)
+    if cluster1Idx == cluster2Idx:
+        # only the Query BGC is paired with itself. Keep its (trivial) row for
+        # the network files, but don't go through the whole comparison
+        dist, jaccard, dss, ai, rDSSna, rDSS, S, Sa, lcsStartA, lcsStartB, seedLength, reverse = self_distance(cluster1, domain_list_A, dcg_a, bgc_class)
+    else:
+        dist, jaccard, dss, ai, rDSSna, rDSS, S, Sa, lcsStartA, lcsStartB, seedLength, reverse = cluster_distance_lcs(cluster1, cluster2, domain_list_A,
+            domain_list_B, dcg_a, dcg_b, core_pos_a, core_pos_b, go_a, go_b, bgc_class)
         
     network_row = array('f',[cluster1Idx, cluster2Idx, dist, (1-dist)**2, jaccard, 
                              dss, ai, rDSSna, rDSS, S, Sa, lcsStartA, lcsStartB, seedLength, reverse])
-    return network_row
+    
+    # Pairs without shared domains take a shortcut in cluster_distance_lcs
+    # (DSS = 0) that re-weighting would not reproduce. They are cheap to 
+    # calculate again anyway
+    raw = None
+    if jaccard > 0 and later_network_count(cluster1Idx, cluster2Idx) > 0:
+        raw = array('d',[jaccard, ai, rDSSna, rDSS, S, Sa, lcsStartA, lcsStartB, seedLength, reverse])
+    return network_row, raw
     
 
 def score_expansion(x_string_, y_string_, downstream):
@@ -627,6 +683,95 @@ def score_expansion(x_string_, y_string_, downstream):
     return max_score, a
 
 
+def combine_dss(DSS_non_anchor, DSS_anchor, S, S_anchor, anchorboost):
+    """Combine the raw DSS of non-anchor and anchor domains into the DSS index
+    (a similarity), boosting the anchor subcomponent with anchorboost"""
+    
+    if S_anchor != 0 and S != 0:
+        # Calculate proper, proportional weight to each kind of domain
+        non_anchor_prct = S / (S + S_anchor)
+        anchor_prct = S_anchor / (S + S_anchor)
+        
+        # boost anchor subcomponent and re-normalize
+        non_anchor_weight = non_anchor_prct / (anchor_prct*anchorboost + non_anchor_prct)
+        anchor_weight = anchor_prct*anchorboost / (anchor_prct*anchorboost + non_anchor_prct)
+
+        # Use anchorboost parameter to boost percieved rDSS_anchor
+        DSS = (non_anchor_weight*DSS_non_anchor) + (anchor_weight*DSS_anchor)
+        
+    elif S_anchor == 0:
+        DSS = DSS_non_anchor
+        
+    else: #only anchor domains were found
+        DSS = DSS_anchor
+ 
+    return 1-DSS #transform into similarity
+
+
+def later_network_count(cluster1Idx, cluster2Idx):
+    """Number of class networks still to be generated that have both BGCs"""
+    return len(pending_bgc_classes.get(cluster1Idx, set()) & pending_bgc_classes.get(cluster2Idx, set()))
+
+
+def reweight_network_row(pair, raw, bgc_class):
+    """Build the network row of a pair that was calculated for a different 
+    class, recalculating the class-dependent values (distance, squared 
+    similarity and DSS). All the other values do not depend on the class weights.
+    raw holds the full precision (not float32) values from cluster_distance_lcs
+    (jaccard, AI, raw DSS non-anchor, raw DSS anchor, S, S anchor, lcsStartA,
+    lcsStartB, seedLength, reverse) so that the result is the same as 
+    calculating the row from scratch"""
+    
+    Jaccardw, DSSw, AIw, anchorboost = bgc_class_weight[bgc_class]
+    
+    jaccard, ai, rDSSna, rDSS, S, Sa, lcsStartA, lcsStartB, seedLength, reverse = raw
+    dss = combine_dss(rDSSna, rDSS, S, Sa, anchorboost)
+    dist = 1 - (Jaccardw * jaccard) - (DSSw * dss) - (AIw * ai)
+    if dist < 0.0:
+        dist = 0.0
+    
+    return array('f',[pair[0], pair[1], dist, (1-dist)**2, jaccard, 
+                      dss, ai, rDSSna, rDSS, S, Sa, lcsStartA, lcsStartB, seedLength, reverse])
+
+
+def reuse_network_row(pair, bgc_class):
+    """Re-weight a cached network row for bgc_class, dropping it from the cache
+    if no network still to be generated needs it"""
+    raw = network_row_cache[pair]
+    if later_network_count(*pair) == 0:
+        del network_row_cache[pair]
+    return reweight_network_row(pair, raw, bgc_class)
+
+
+def evict_network_rows():
+    """Drop the cached rows that no network still to be generated needs (e.g.
+    rows of pairs that a Query BGC network did not use)"""
+    for pair in [pair for pair in network_row_cache if later_network_count(*pair) == 0]:
+        del network_row_cache[pair]
+
+
+def self_distance(A, A_domlist, dcg_A, bgc_class):
+    """Same output as cluster_distance_lcs for a BGC against itself: all
+    domains are shared and all copies match perfectly (Jaccard = DSS = 1 and
+    the raw DSS are 0). The AI is 1 unless there are no adjacent domains"""
+    
+    Jaccardw, DSSw, AIw, anchorboost = bgc_class_weight[bgc_class]
+    
+    S_anchor = sum(1 for domain in A_domlist if domain[:7] in anchor_domains)
+    S = len(A_domlist) - S_anchor
+    
+    if len(A_domlist) < 2:
+        AI = 0.0
+    else:
+        AI = 1.0
+    
+    Distance = 1 - (Jaccardw * 1.0) - (DSSw * 1.0) - (AIw * AI)
+    if Distance < 0.0:
+        Distance = 0.0
+    
+    return Distance, 1.0, 1.0, AI, 0.0, 0.0, S, S_anchor, 0, 0, len(dcg_A), 0.0
+
+
 def cluster_distance_lcs(A, B, A_domlist, B_domlist, dcg_A, dcg_b, core_pos_A, core_pos_b, go_A, go_b, bgc_class):
     """Compare two clusters using information on their domains, and the 
     sequences of the domains. 
@@ -648,15 +793,14 @@ def cluster_distance_lcs(A, B, A_domlist, B_domlist, dcg_A, dcg_b, core_pos_A, c
     """
     
     Jaccardw, DSSw, AIw, anchorboost = bgc_class_weight[bgc_class]
-
-    temp_domain_fastas = {}
     
     # Number of genes in each BGC
     lenG_A = len(dcg_A)
     lenG_B = len(dcg_b)
     
-    setA = set(A_domlist)
-    setB = set(B_domlist)
+    # set of domains of each BGC is built once in the main process
+    setA = DomainSet[A] if A in DomainSet else frozenset(A_domlist)
+    setB = DomainSet[B] if B in DomainSet else frozenset(B_domlist)
     intersect = setA & setB
     
     S = 0
@@ -977,23 +1121,17 @@ def cluster_distance_lcs(A, B, A_domlist, B_domlist, dcg_A, dcg_b, core_pos_A, c
                 # re-adjust the indices for each domain so we get only the sequence
                 # tags in the selected slice. First step: find out which is the 
                 # first copy of each domain we're using
-                for domain in A_domlist[:domA_start]:
-                    A_domain_sequence_slice_bottom[domain] += 1
-                for domain in B_domlist[:domB_start]:
-                    B_domain_sequence_slice_bottom[domain] += 1
+                A_domain_sequence_slice_bottom.update(Counter(A_domlist[:domA_start]))
+                B_domain_sequence_slice_bottom.update(Counter(B_domlist[:domB_start]))
                     
-                # Step 2: work with the last copy of each domain. 
-                # Step 2a: make top = bottom
+                # Step 2: work with the last copy of each domain: top is
+                # bottom plus the number of copies inside the slice
+                A_slice_counts = Counter(A_domlist[domA_start:domA_end])
                 for domain in setA:
-                    A_domain_sequence_slice_top[domain] = A_domain_sequence_slice_bottom[domain]
+                    A_domain_sequence_slice_top[domain] = A_domain_sequence_slice_bottom[domain] + A_slice_counts[domain]
+                B_slice_counts = Counter(B_domlist[domB_start:domB_end])
                 for domain in setB:
-                    B_domain_sequence_slice_top[domain] = B_domain_sequence_slice_bottom[domain]
-                
-                # Step 2b: increase top with the domains in the slice
-                for domain in A_domlist[domA_start:domA_end]:
-                    A_domain_sequence_slice_top[domain] += 1
-                for domain in B_domlist[domB_start:domB_end]:
-                    B_domain_sequence_slice_top[domain] += 1
+                    B_domain_sequence_slice_top[domain] = B_domain_sequence_slice_bottom[domain] + B_slice_counts[domain]
                     
             #else:
                 #print(" - - Not a valid overlap found - - (no biosynthetic genes)\n")
@@ -1039,53 +1177,26 @@ def cluster_distance_lcs(A, B, A_domlist, B_domlist, dcg_A, dcg_b, core_pos_A, c
         
     # Cases 2 and 3 (now merged)
     for shared_domain in intersect:
-        specific_domain_list_A = BGCs[A][shared_domain]
-        specific_domain_list_B = BGCs[B][shared_domain]
-        
         num_copies_a = A_domain_sequence_slice_top[shared_domain] - A_domain_sequence_slice_bottom[shared_domain]
         num_copies_b = B_domain_sequence_slice_top[shared_domain] - B_domain_sequence_slice_bottom[shared_domain]
         
-        temp_domain_fastas.clear()
-        
-        accumulated_distance = 0
-            
         # Fill distance matrix between domain's A and B versions
-        DistanceMatrix = np.ndarray((num_copies_a,num_copies_b))
-        for domsa in range(num_copies_a):
-            for domsb in range(num_copies_b):
-                sequence_tag_a = specific_domain_list_A[domsa + A_domain_sequence_slice_bottom[shared_domain]]
-                sequence_tag_b = specific_domain_list_B[domsb + B_domain_sequence_slice_bottom[shared_domain]]
-                
-                seq_length = 0
-                matches = 0
-                gaps = 0
-                
-                aligned_seqA = AlignedDomainSequences[sequence_tag_a]
-                aligned_seqB = AlignedDomainSequences[sequence_tag_b]
-                    
-                # - Calculate aligned domain sequences similarity -
-                # Sequences *should* be of the same length unless something went
-                # wrong elsewhere
-                if len(aligned_seqA) != len(aligned_seqB):
-                    print("\tWARNING: mismatch in sequences' lengths while calculating sequence identity ({})".format(shared_domain))
-                    print("\t  Specific domain 1: {} len: {}".format(sequence_tag_a, str(len(aligned_seqA))))
-                    print("\t  Specific domain 2: {} len: {}".format(sequence_tag_b, str(len(aligned_seqB))))
-                    seq_length = min(len(aligned_seqA), len(aligned_seqB))
-                else:
-                    seq_length = len(aligned_seqA)
-                    
-                for position in range(seq_length):
-                    if aligned_seqA[position] == aligned_seqB[position]:
-                        if aligned_seqA[position] != "-":
-                            matches += 1
-                        else:
-                            gaps += 1
-                            
-                DistanceMatrix[domsa][domsb] = 1 - ( matches/(seq_length-gaps) )
-                
-        #Only use the best scoring pairs
-        BestIndexes = linear_sum_assignment(DistanceMatrix)
-        accumulated_distance = DistanceMatrix[BestIndexes].sum()
+        bottom_a = A_domain_sequence_slice_bottom[shared_domain]
+        bottom_b = B_domain_sequence_slice_bottom[shared_domain]
+        rows_a = DomainRows[A][shared_domain][bottom_a:bottom_a+num_copies_a]
+        rows_b = DomainRows[B][shared_domain][bottom_b:bottom_b+num_copies_b]
+
+        # - Calculate aligned domain sequences similarity -
+        aligned_seqs = AlignedDomainArrays[shared_domain]
+        DistanceMatrix = calc_distance_matrix(aligned_seqs[rows_a], aligned_seqs[rows_b])
+
+        #Only use the best scoring pairs. Most domains are single-copy, and
+        # then there is nothing to assign
+        if num_copies_a == 1 and num_copies_b == 1:
+            accumulated_distance = DistanceMatrix[0, 0]
+        else:
+            row_ind, col_ind = linear_sum_assignment(DistanceMatrix)
+            accumulated_distance = DistanceMatrix[row_ind, col_ind].sum()
         
         # the difference in number of domains accounts for the "lost" (or not duplicated) domains
         sum_seq_dist = (abs(num_copies_a-num_copies_b) + accumulated_distance)  #essentially 1-sim
@@ -1102,30 +1213,15 @@ def cluster_distance_lcs(A, B, A_domlist, B_domlist, dcg_A, dcg_b, core_pos_A, c
         DSS_non_anchor = domain_difference / S
         DSS_anchor = domain_difference_anchor / S_anchor
         
-        # Calculate proper, proportional weight to each kind of domain
-        non_anchor_prct = S / (S + S_anchor)
-        anchor_prct = S_anchor / (S + S_anchor)
-        
-        # boost anchor subcomponent and re-normalize
-        non_anchor_weight = non_anchor_prct / (anchor_prct*anchorboost + non_anchor_prct)
-        anchor_weight = anchor_prct*anchorboost / (anchor_prct*anchorboost + non_anchor_prct)
-
-        # Use anchorboost parameter to boost percieved rDSS_anchor
-        DSS = (non_anchor_weight*DSS_non_anchor) + (anchor_weight*DSS_anchor)
-        
     elif S_anchor == 0:
         DSS_non_anchor = domain_difference / S
         DSS_anchor = 0.0
         
-        DSS = DSS_non_anchor
-        
     else: #only anchor domains were found
         DSS_non_anchor = 0.0
         DSS_anchor = domain_difference_anchor / S_anchor
         
-        DSS = DSS_anchor
- 
-    DSS = 1-DSS #transform into similarity
+    DSS = combine_dss(DSS_non_anchor, DSS_anchor, S, S_anchor, anchorboost)
  
 
     # ADJACENCY INDEX
@@ -1134,13 +1230,17 @@ def cluster_distance_lcs(A, B, A_domlist, B_domlist, dcg_A, dcg_b, core_pos_A, c
     if len(A_domlist[domA_start:domA_end]) < 2 or len(B_domlist[domB_start:domB_end]) < 2:
         AI = 0.0
     else:
-        setA_pairs = set()
-        for l in range(domA_start, domA_end-1):
-            setA_pairs.add(tuple(sorted([A_domlist[l],A_domlist[l+1]])))
+        # pairs for the complete domain lists are built once in the main
+        # process; only LCS-extended slices need to be calculated here
+        if domA_start == 0 and domA_end == len(A_domlist) and A in DomainPairSet:
+            setA_pairs = DomainPairSet[A]
+        else:
+            setA_pairs = get_adjacent_domain_pairs(A_domlist[domA_start:domA_end])
         
-        setB_pairs = set()
-        for l in range(domB_start, domB_end-1):
-            setB_pairs.add(tuple(sorted([B_domlist[l],B_domlist[l+1]])))
+        if domB_start == 0 and domB_end == len(B_domlist) and B in DomainPairSet:
+            setB_pairs = DomainPairSet[B]
+        else:
+            setB_pairs = get_adjacent_domain_pairs(B_domlist[domB_start:domB_end])
 
         # same treatment as in Jaccard
         AI = len(setA_pairs & setB_pairs) / len(setA_pairs | setB_pairs)
@@ -1169,8 +1269,14 @@ def launch_hmmalign(cores, domain_sequence_list):
     Launches instances of hmmalign with multiprocessing.
     Note that the domains parameter contains the .fasta extension
     """
+    # Domain files vary wildly in size (from a couple of sequences to
+    # thousands). Hand them out one at a time, largest first, so that a few
+    # big alignments don't end up queued behind each other in the same worker
+    domain_sequence_list = sorted(domain_sequence_list, key=os.path.getsize, reverse=True)
+    
     pool = get_context("fork").Pool(cores, maxtasksperchild=32)
-    pool.map(run_hmmalign, domain_sequence_list)
+    for _ in pool.imap_unordered(run_hmmalign, domain_sequence_list, 1):
+        pass
     pool.close()
     pool.join()
    
@@ -1216,28 +1322,16 @@ def stockholm_parser(stkFile):
                     algn = a[-1]
                     algnDict[header] += algn
                     
-        # get start-end coordinates of every "x" island (original consensus)
-        # in the reference
-        state_reference = False
-        slicing_tuples = []
-        for pos in range(len(reference)):
-            if reference[pos] == "x" and not state_reference:
-                state_reference = True
-                start = pos
-            if reference[pos] == "." and state_reference:
-                state_reference = False
-                slicing_tuples.append((start,pos))
-        if state_reference:
-            slicing_tuples.append((start, len(reference)))
+        # keep only the columns of the original consensus ("x" in the
+        # reference), selecting them on the whole byte array at once
+        consensus_columns = np.flatnonzero(np.frombuffer(reference.encode("ascii"), dtype=np.uint8) == ord("x"))
     
     if len(algnDict) > 0:
         with open(algnFile, "w") as outfile:
             for header in algnDict:
-                sequence = ""
-                for a,b in slicing_tuples:
-                    sequence += algnDict[header][a:b]
+                sequence = np.frombuffer(algnDict[header].encode("ascii"), dtype=np.uint8)[consensus_columns]
                 outfile.write(">{}\n".format(header))
-                outfile.write(sequence + "\n")
+                outfile.write(sequence.tobytes().decode("ascii") + "\n")
     return
 
 
@@ -1249,60 +1343,173 @@ def runHmmScan(fastaPath, hmmPath, outputdir, verbose):
         name = ".".join(fastaPath.split(os.sep)[-1].split(".")[:-1])
         outputName = os.path.join(outputdir, name+".domtable")
         
-        hmmscan_cmd = "hmmscan --cpu 0 --domtblout {} --cut_tc {} {}".format(outputName, hmmFile, fastaPath)
+        hmmscan_cmd = ["hmmscan", "--cpu", "0", "--domtblout", outputName, "--cut_tc", hmmFile, fastaPath]
         if verbose == True:
-            print("   " + hmmscan_cmd)
-        subprocess.check_output(hmmscan_cmd, shell=True)
+            print("   " + " ".join(hmmscan_cmd))
+        subprocess.check_output(hmmscan_cmd, shell=False)
 
     else:
         sys.exit("Error running hmmscan: Fasta file " + fastaPath + " doesn't exist")
 
 
-def parseHmmScan(hmmscanResults, pfd_folder, pfs_folder, overlapCutoff):
-    outputbase = ".".join(hmmscanResults.split(os.sep)[-1].split(".")[:-1])
-    # try to read the domtable file to find out if this gbk has domains. Domains
-    # need to be parsed into fastas anyway.
-    if os.path.isfile(hmmscanResults):
-        pfd_matrix = domtable_parser(outputbase, hmmscanResults)
-        
-        # get number of domains to decide if this BGC should be removed
-        num_domains = len(pfd_matrix)
+def runPyHmmScan(fastaPaths, hmmPath, outputdir, cores, verbose):
+    """ Runs hmmscan in-process (pyhmmer) on a list of fasta files to generate
+    their domtable files. The Pfam database is only read once and shared by
+    all the searches"""
+    for fastaPath in fastaPaths:
+        if not os.path.isfile(fastaPath):
+            sys.exit("Error running hmmscan: Fasta file " + fastaPath + " doesn't exist")
 
-        if num_domains > 0:
-            if verbose:
-                print("  Processing domtable file: " + outputbase)
+    hmmFile = os.path.join(hmmPath,"Pfam-A.hmm")
+    alphabet = pyhmmer.easel.Alphabet.amino()
+    with pyhmmer.plan7.HMMFile(hmmFile) as hmm_handle:
+        profiles = pyhmmer.plan7.OptimizedProfileBlock(alphabet, hmm_handle.optimized_profiles())
+
+    # pyhmmer releases the GIL, so we can use threads (sharing the profiles)
+    # instead of processes. Many single-core searches scale better than a
+    # single search using many cores.
+    # All threads must get this same block: its per-profile locks are what
+    # keep concurrent searches from reconfiguring a shared profile under
+    # each other (separate blocks over the same profiles don't share locks)
+    with ThreadPool(cores) as pool:
+        pool.starmap(pyHmmScanFile, [(fastaPath, profiles, hmmFile, outputdir, verbose) for fastaPath in fastaPaths], 1)
+
+
+def pyHmmScanFile(fastaPath, profiles, hmmFile, outputdir, verbose):
+    """ Scans the sequences of one fasta file against the (already loaded)
+    OptimizedProfileBlock with a single core and writes its domtable file"""
+    name = ".".join(fastaPath.split(os.sep)[-1].split(".")[:-1])
+    outputName = os.path.join(outputdir, name+".domtable")
+    if verbose == True:
+        print("   pyhmmer hmmscan --cut_tc {} {}".format(hmmFile, fastaPath))
+
+    with pyhmmer.easel.SequenceFile(fastaPath, digital=True, alphabet=profiles.alphabet) as seq_handle:
+        sequences = seq_handle.read_block()
+
+    with open(outputName, "wb") as domtable_handle:
+        header = True
+        for top_hits in pyhmmer.hmmer.hmmscan(sequences, profiles, cpus=1, bit_cutoffs="trusted"):
+            top_hits.write(domtable_handle, format="domains", header=header)
+            header = False
+        # Same footer as hmmscan's. Used to check for complete domtable
+        # files when re-running BiG-SCAPE
+        domtable_handle.write("#\n# Program:         hmmscan\n# Version:         pyhmmer {}\n# Pipeline mode:   SCAN\n# Query file:      {}\n# Target file:     {}\n# Option settings: hmmscan --domtblout {} --cut_tc {} {}\n# [ok]\n".format(pyhmmer.__version__, fastaPath, hmmFile, outputName, hmmFile, fastaPath).encode())
 
-            # check_overlap also sorts the filtered_matrix results and removes
-            # overlapping domains, keeping the highest scoring one
-            filtered_matrix, domains = check_overlap(pfd_matrix,overlapCutoff)
-            
-            # Save list of domains per BGC
-            pfsoutput = os.path.join(pfs_folder, outputbase + ".pfs")
-            with open(pfsoutput, 'w') as pfs_handle:
-                pfs_handle.write(" ".join(domains))
-            
-            # Save more complete information of each domain per BGC
-            pfdoutput = os.path.join(pfd_folder, outputbase + ".pfd")
-            with open(pfdoutput,'w') as pfd_handle:
-                write_pfd(pfd_handle, filtered_matrix)
-        else:
-            # there aren't any domains in this BGC
-            # delete from all data structures
-            print("  No domains where found in {}.domtable. Removing it from further analysis".format(outputbase))
-            info = genbankDict.get(outputbase)
-            clusters.remove(outputbase)
-            baseNames.remove(outputbase)
-            gbk_files.remove(info[0])
-            for sample in info[1]:
-                sampleDict[sample].remove(outputbase)
-            del genbankDict[outputbase]
-            if outputbase in mibig_set:
-                mibig_set.remove(outputbase)
-            
-    else:
-        sys.exit("Error: hmmscan file " + outputbase + " was not found! (parseHmmScan)")
 
-    return("")
+def parseHmmScan(hmmscanResults, pfd_folder, pfs_folder, overlapCutoff):
+    """Parse a domtable file and write the BGC's pfs and pfd files.
+    Returns the BGC's name and whether any domains were found. Runs in a
+    worker process, so removing domain-less BGCs is left to the caller"""
+    outputbase = ".".join(hmmscanResults.split(os.sep)[-1].split(".")[:-1])
+    # read the domtable file to find out if this gbk has domains. Domains
+    # need to be parsed into fastas anyway. Existence of all domtable files
+    # has been verified before launching the workers
+    pfd_matrix = domtable_parser(outputbase, hmmscanResults)
+    
+    # get number of domains to decide if this BGC should be removed
+    num_domains = len(pfd_matrix)
+
+    if num_domains > 0:
+        if verbose:
+            print("  Processing domtable file: " + outputbase)
+
+        # check_overlap also sorts the filtered_matrix results and removes
+        # overlapping domains, keeping the highest scoring one
+        filtered_matrix, domains = check_overlap(pfd_matrix,overlapCutoff)
+        
+        # Save list of domains per BGC
+        pfsoutput = os.path.join(pfs_folder, outputbase + ".pfs")
+        with open(pfsoutput, 'w') as pfs_handle:
+            pfs_handle.write(" ".join(domains))
+        
+        # Save more complete information of each domain per BGC
+        pfdoutput = os.path.join(pfd_folder, outputbase + ".pfd")
+        with open(pfdoutput,'w') as pfd_handle:
+            write_pfd(pfd_handle, filtered_matrix)
+
+    return outputbase, num_domains > 0
+
+
+def remove_domainless_bgc(outputbase):
+    """Delete a BGC without predicted domains from all data structures"""
+    print("  No domains where found in {}.domtable. Removing it from further analysis".format(outputbase))
+    info = genbankDict.get(outputbase)
+    clusters.remove(outputbase)
+    baseNames.remove(outputbase)
+    gbk_files.remove(info[0])
+    for sample in info[1]:
+        sampleDict[sample].remove(outputbase)
+    del genbankDict[outputbase]
+    if outputbase in mibig_set:
+        mibig_set.remove(outputbase)
+
+
+# Key: BGC name. Item: the BGC's data for the visualization (see
+# get_bgc_json_data). It only depends on the BGC's fasta and pfd files, so it
+# is shared by all the networks the BGC appears in
+bgc_json_cache = {}
+
+def get_bgc_json_data(bgcName):
+    """Build (once) the visualization data of a BGC: its ORFs and their
+    domains, read from its fasta and pfd files"""
+    if bgcName in bgc_json_cache:
+        return bgc_json_cache[bgcName]
+    
+    bgcJson = {}
+    bgcJson["id"] = bgcName
+    bgcJson["desc"] = bgc_info[bgcName].description
+    bgcJson["start"] = 1
+    bgcJson["end"] = bgc_info[bgcName].bgc_size
+    bgcJson["mibig"] = bgcName in mibig_set
+    
+    pfdFile = os.path.join(pfd_folder, bgcName + ".pfd")
+    fastaFile = os.path.join(bgc_fasta_folder, bgcName + ".fasta")
+    
+    orfDict = defaultdict(dict)
+    
+    ## read fasta file first to get orfs
+    # We cannot get all the info exclusively from the pfd because that only
+    # contains ORFs with predicted domains (and we need to draw empty genes
+    # as well)
+    with open(fastaFile) as fastaFile_handle:
+        for line in fastaFile_handle:
+            if line[0] == ">":
+                header = line.strip()[1:].split(':')
+                orf = header[0]
+                if header[2]:
+                    orfDict[orf]["id"] = header[2]
+                elif header[4]:
+                    orfDict[orf]["id"] = header[4]
+                else:
+                    orfDict[orf]["id"] = orf
+                    
+                ## broken gene goes into cluster, need this so js doesn't throw an error
+                if int(header[6]) <= 1:
+                    orfDict[orf]["start"] = 1
+                else:
+                    orfDict[orf]["start"] = int(header[6])
+                    
+                orfDict[orf]["end"] = int(header[7])
+                
+                if header[-1] == '+':
+                    orfDict[orf]["strand"] = 1
+                else:
+                    orfDict[orf]["strand"] = -1
+                    
+                orfDict[orf]["domains"] = []
+
+    ## now read pfd file to add the domains to each of the orfs
+    with open(pfdFile) as pfdFile_handle:
+        for line in pfdFile_handle:
+            entry = line.split('\t')
+            orf = entry[-1].strip().split(':')[0]
+            pfamID = entry[5].split('.')[0]
+            orfDict[orf]["domains"].append({'code': pfamID, 'start': int(entry[3]), 'end': int(entry[4]), 'bitscore': float(entry[1])})
+    # order of ORFs is important here because I use it to get a translation
+    # between the "list of ORFs with domains" to "list of all ORFs" later on
+    bgcJson['orfs'] = sorted(orfDict.values(), key=itemgetter("start"))
+    bgc_json_cache[bgcName] = bgcJson
+    return bgcJson
 
 
 def clusterJsonBatch(bgcs, pathBase, className, matrix, pos_alignments, cutoffs=[1.0], damping=0.9, clusterClans=False, clanCutoff=(0.5,0.8), htmlFolder=None):
@@ -1321,6 +1528,11 @@ def clusterJsonBatch(bgcs, pathBase, className, matrix, pos_alignments, cutoffs=
         to indices from `bgcs`
     pathBase: folder where GCF files will be deposited
     """
+    # Only needed from here on. Importing them late keeps them out of the
+    # start-up, domain prediction and alignment steps (and --help)
+    from sklearn.cluster import AffinityPropagation
+    from Bio import Phylo
+    
     numBGCs = len(bgcs)
     
     simDict = {} # dictionary of dictionaries
@@ -1348,59 +1560,7 @@ def clusterJsonBatch(bgcs, pathBase, className, matrix, pos_alignments, cutoffs=
     bgcJsonDict = {}
     for bgc in bgcs:
         bgcName = clusterNames[bgc]
-        bgcJsonDict[bgcName] = {}
-        bgcJsonDict[bgcName]["id"] = bgcName
-        bgcJsonDict[bgcName]["desc"] = bgc_info[bgcName].description
-        bgcJsonDict[bgcName]["start"] = 1
-        bgcJsonDict[bgcName]["end"] = bgc_info[bgcName].bgc_size
-        bgcJsonDict[bgcName]["mibig"] = bgcName in mibig_set
-        
-        pfdFile = os.path.join(pfd_folder, bgcName + ".pfd")
-        fastaFile = os.path.join(bgc_fasta_folder, bgcName + ".fasta")
-        
-        orfDict = defaultdict(dict)
-        
-        ## read fasta file first to get orfs
-        # We cannot get all the info exclusively from the pfd because that only
-        # contains ORFs with predicted domains (and we need to draw empty genes
-        # as well)
-        with open(fastaFile) as fastaFile_handle:
-            for line in fastaFile_handle:
-                if line[0] == ">":
-                    header = line.strip()[1:].split(':')
-                    orf = header[0]
-                    if header[2]:
-                        orfDict[orf]["id"] = header[2]
-                    elif header[4]:
-                        orfDict[orf]["id"] = header[4]
-                    else:
-                        orfDict[orf]["id"] = orf
-                        
-                    ## broken gene goes into cluster, need this so js doesn't throw an error
-                    if int(header[6]) <= 1:
-                        orfDict[orf]["start"] = 1
-                    else:
-                        orfDict[orf]["start"] = int(header[6])
-                        
-                    orfDict[orf]["end"] = int(header[7])
-                    
-                    if header[-1] == '+':
-                        orfDict[orf]["strand"] = 1
-                    else:
-                        orfDict[orf]["strand"] = -1
-                        
-                    orfDict[orf]["domains"] = []
-    
-        ## now read pfd file to add the domains to each of the orfs
-        with open(pfdFile) as pfdFile_handle:
-            for line in pfdFile_handle:
-                entry = line.split('\t')
-                orf = entry[-1].strip().split(':')[0]
-                pfamID = entry[5].split('.')[0]
-                orfDict[orf]["domains"].append({'code': pfamID, 'start': int(entry[3]), 'end': int(entry[4]), 'bitscore': float(entry[1])})
-        # order of ORFs is important here because I use it to get a translation
-        # between the "list of ORFs with domains" to "list of all ORFs" later on
-        bgcJsonDict[bgcName]['orfs'] = sorted(orfDict.values(), key=itemgetter("start"))
+        bgcJsonDict[bgcName] = get_bgc_json_data(bgcName)
     bs_data = [bgcJsonDict[clusterNames[bgc]] for bgc in bgcs]
     
     
@@ -1509,7 +1669,7 @@ def clusterJsonBatch(bgcs, pathBase, className, matrix, pos_alignments, cutoffs=
             # make a frequency table (not counting copies):
             frequency_table = defaultdict(int)
             for bgc in gcf:
-                domain_sets[bgc] = set(DomainList[clusterNames[bgc]])
+                domain_sets[bgc] = DomainSet[clusterNames[bgc]]
                 for domain in domain_sets[bgc]:
                     frequency_table[domain] += 1
             
@@ -1556,12 +1716,13 @@ def clusterJsonBatch(bgcs, pathBase, className, matrix, pos_alignments, cutoffs=
 
             match_dict = {}
             for domain in tree_domains:
-                specific_domain_list_A = BGCs[exemplar][domain]
-                num_copies_a = len(specific_domain_list_A)
-                for exemplar_domain_copy in specific_domain_list_A:
-                    alignments[exemplar_idx] += AlignedDomainSequences[exemplar_domain_copy]
+                aligned_seqs = AlignedDomainArrays[domain]
+                rows_a = DomainRows[exemplar][domain]
+                num_copies_a = len(rows_a)
+                for row in rows_a:
+                    alignments[exemplar_idx] += aligned_seqs[row].tobytes().decode("ascii")
                 
-                seq_length = len(AlignedDomainSequences[specific_domain_list_A[0]])
+                seq_length = aligned_seqs.shape[1]
                 
                 for bgc in alignments:
                     match_dict.clear()
@@ -1575,33 +1736,13 @@ def clusterJsonBatch(bgcs, pathBase, className, matrix, pos_alignments, cutoffs=
                     elif bgc in delete_list:
                         pass
                     else:
-                        specific_domain_list_B = BGCs[clusterNames[bgc]][domain]
-                        
-                        num_copies_b = len(specific_domain_list_B)
-                        
-                        DistanceMatrix = np.ndarray((num_copies_a,num_copies_b))
+                        rows_b = DomainRows[clusterNames[bgc]][domain]
                         
-                        for domsa in range(num_copies_a):
-                            for domsb in range(num_copies_b):
-                                # TODO NOT taking into consideration any LCS slicing
-                                # i.e. we're comparing ALL copies of this domain
-                                sequence_tag_a = specific_domain_list_A[domsa]
-                                sequence_tag_b = specific_domain_list_B[domsb]
-                                
-                                aligned_seqA = AlignedDomainSequences[sequence_tag_a]
-                                aligned_seqB = AlignedDomainSequences[sequence_tag_b]
-                                
-                                matches = 0
-                                gaps = 0
-                                
-                                for position in range(seq_length):
-                                    if aligned_seqA[position] == aligned_seqB[position]:
-                                        if aligned_seqA[position] != "-":
-                                            matches += 1
-                                        else:
-                                            gaps += 1
-                                            
-                                DistanceMatrix[domsa][domsb] = 1 - ( matches/(seq_length-gaps) )
+                        num_copies_b = len(rows_b)
+
+                        # TODO NOT taking into consideration any LCS slicing
+                        # i.e. we're comparing ALL copies of this domain
+                        DistanceMatrix = calc_distance_matrix(aligned_seqs[rows_a], aligned_seqs[rows_b])
 
                         BestIndexes = linear_sum_assignment(DistanceMatrix)
                         # at this point is not ensured that we have the same order
@@ -1612,7 +1753,7 @@ def clusterJsonBatch(bgcs, pathBase, className, matrix, pos_alignments, cutoffs=
                             
                         for copy in range(num_copies_a):
                             try:
-                                alignments[bgc] += AlignedDomainSequences[specific_domain_list_B[match_dict[copy]]]
+                                alignments[bgc] += aligned_seqs[rows_b[match_dict[copy]]].tobytes().decode("ascii")
                             except KeyError:
                                 # This means that this copy of exemplar did not
                                 # have a match in bgc (i.e. bgc has less copies
@@ -1649,7 +1790,7 @@ def clusterJsonBatch(bgcs, pathBase, className, matrix, pos_alignments, cutoffs=
                 p.wait() # only with process has terminated will the file be ready
 
             # read tree, post-process it and save it
-            if not os.path.isfile(newick_file_path) or os.path.getsize(newick_file_path) == 0:
+            if not is_non_empty_file(newick_file_path):
                 print(newick_file_path)
                 sys.exit(" ERROR: newick file not created or empty (GCF_c{:4.2f}_{:05d})".format(cutoff,exemplar_idx))
             else:
@@ -1688,7 +1829,7 @@ def clusterJsonBatch(bgcs, pathBase, className, matrix, pos_alignments, cutoffs=
                 famSimMatrix = np.zeros((len(familyIdx), len(familyIdx)), dtype=np.float32)
                 familiesExt2Int = {gcfExtIdx:gcfIntIdx for gcfIntIdx,gcfExtIdx in enumerate(familyIdx)}
                 
-                for familyI, familyJ in [tuple(sorted(combo)) for combo in combinations(familyIdx, 2)]:
+                for familyI, familyJ in combinations(familyIdx, 2):
                     famSimilarities = []
                     # currently uses the average distance of all average distances
                     # between bgc from gcf I to all bgcs from gcf J
@@ -1958,7 +2099,7 @@ def CMD_parser():
                         Toggle to activate.")
     
     parser.add_argument("-d", "--domain_overlap_cutoff", 
-                        dest="domain_overlap_cutoff", default=0.1, help="Specify\
+                        dest="domain_overlap_cutoff", default=0.1, type=float, help="Specify\
                         at which overlap percentage domains are considered to \
                         overlap. Domain with the best score is kept \
                         (default=0.1).")
@@ -2114,8 +2255,11 @@ if __name__=="__main__":
     
     global force_hmmscan
     global bgc_class_weight
-    global AlignedDomainSequences
+    global AlignedDomainArrays
+    global DomainRows
     global DomainList
+    global DomainSet
+    global DomainPairSet
     global DomainCountGene
     global corebiosynthetic_position
     global verbose
@@ -2135,6 +2279,7 @@ if __name__=="__main__":
     run_data = {}
 
     global clusterNames, bgcClassNames
+    global network_row_cache, pending_bgc_classes
     
     include_singletons = options.include_singletons
     
@@ -2228,7 +2373,7 @@ if __name__=="__main__":
     run_data["parameters"] = " ".join(sys.argv[1:])
     run_data["input"] = {}
 
-    # Make the following available for possibly deleting entries within parseHmmScan
+    # Make the following available for possibly deleting entries within remove_domainless_bgc
     global gbk_files, sampleDict, clusters, baseNames
     
     
@@ -2414,8 +2559,11 @@ if __name__=="__main__":
 
     bgcClassName2idx = dict(zip(bgcClassNames,range(len(bgcClassNames))))
 
-    AlignedDomainSequences = {} # Key: specific domain sequence label. Item: aligned sequence
+    AlignedDomainArrays = {} # Key: domain. Item: uint8 array with one aligned sequence per row
+    DomainRows = {} # Key: BGC. Item: {domain: rows of its copies in AlignedDomainArrays[domain]}
     DomainList = {} # Key: BGC. Item: ordered list of domains
+    DomainSet = {} # Key: BGC. Item: frozenset of the domains in DomainList
+    DomainPairSet = {} # Key: BGC. Item: frozenset of adjacent domain pairs in DomainList
     
     # Key: BGC. Item: ordered list of simple integers with the number of domains
     # in each gene
@@ -2437,13 +2585,15 @@ if __name__=="__main__":
     baseNames = set(clusters)
     
     # All available fasta files (could be more than it should if reusing output folder)
-    allFastaFiles = set(glob(os.path.join(bgc_fasta_folder,"*.fasta")))
+    allFastaFiles = set(list_files(bgc_fasta_folder, ".fasta"))
     
     # fastaFiles: all the fasta files that should be there 
     # (i.e. correspond to the input files)
-    fastaFiles = set()
-    for name in baseNames:
-        fastaFiles.add(os.path.join(bgc_fasta_folder, name+".fasta"))
+    # Folder prefixes are joined once for the per-BGC paths built below
+    fasta_prefix = os.path.join(bgc_fasta_folder, "")
+    domtable_prefix = os.path.join(domtable_folder, "")
+    pfd_prefix = os.path.join(pfd_folder, "")
+    fastaFiles = {fasta_prefix + name + ".fasta" for name in baseNames}
 
     # fastaBases: the actual fasta files we have that correspond to the input
     fastaBases = allFastaFiles.intersection(fastaFiles)
@@ -2461,13 +2611,13 @@ if __name__=="__main__":
     else:
         # find already processed files
         alreadyDone = set()
-        for fasta in fastaFiles:
-            outputbase  = ".".join(fasta.split(os.sep)[-1].split(".")[:-1])
-            outputfile = os.path.join(domtable_folder,outputbase + '.domtable')
-            if os.path.isfile(outputfile) and os.path.getsize(outputfile) > 0:
+        for outputbase in baseNames:
+            fasta = fasta_prefix + outputbase + ".fasta"
+            outputfile = domtable_prefix + outputbase + ".domtable"
+            if is_non_empty_file(outputfile):
                 # verify domtable content
                 with open(outputfile, "r") as domtablefile:
-                    for line in domtablefile.readlines():
+                    for line in domtablefile:
                         if line.startswith("# Option settings:"):
                             linecols = line.split()
                             if "hmmscan" in linecols and "--domtblout" in linecols:
@@ -2485,23 +2635,28 @@ if __name__=="__main__":
         else:
             print(" Predicting domains for {} fasta files".format(str(len(fastaFiles))))
         
-    pool = get_context("fork").Pool(cores,maxtasksperchild=1)
-    for fastaFile in task_set:
-        pool.apply_async(runHmmScan,args=(fastaFile, pfam_dir, domtable_folder, verbose))
-    pool.close()
-    pool.join()
+    # Launch the largest fasta files first so that a few big BGCs don't end 
+    # up being processed last, on their own, while the other workers idle
+    task_list = sorted(task_set, key=os.path.getsize, reverse=True)
+    if pyhmmer is not None:
+        if len(task_list) > 0:
+            runPyHmmScan(task_list, pfam_dir, domtable_folder, cores, verbose)
+    else:
+        pool = get_context("fork").Pool(cores,maxtasksperchild=1)
+        for fastaFile in task_list:
+            pool.apply_async(runHmmScan,args=(fastaFile, pfam_dir, domtable_folder, verbose))
+        pool.close()
+        pool.join()
     print(" Finished generating domtable files.")
 
     ### Step 3: Parse hmmscan domtable results and generate pfs and pfd files
     print("\nParsing hmmscan domtable files")
     
     # All available domtable files
-    allDomtableFiles = set(glob(os.path.join(domtable_folder,"*.domtable")))
+    allDomtableFiles = set(list_files(domtable_folder, ".domtable"))
     
     # domtableFiles: all domtable files corresponding to the input files
-    domtableFiles = set()
-    for name in baseNames:
-        domtableFiles.add(os.path.join(domtable_folder, name+".domtable"))
+    domtableFiles = {domtable_prefix + name + ".domtable" for name in baseNames}
     
     # domtableBases: the actual set of input files with coresponding domtable files
     domtableBases = allDomtableFiles.intersection(domtableFiles)
@@ -2512,12 +2667,12 @@ if __name__=="__main__":
     
     # find already processed files (assuming that if the pfd file exists, the pfs should too)
     alreadyDone = set()
+    alreadyDoneBases = set()
     if not force_hmmscan:
-        for domtable in domtableFiles:
-            outputbase = ".".join(domtable.split(os.sep)[-1].split(".")[:-1])
-            outputfile = os.path.join(pfd_folder, outputbase + '.pfd')
-            if os.path.isfile(outputfile) and os.path.getsize(outputfile) > 0:
-                alreadyDone.add(domtable)
+        for outputbase in baseNames:
+            if is_non_empty_file(pfd_prefix + outputbase + ".pfd"):
+                alreadyDone.add(domtable_prefix + outputbase + ".domtable")
+                alreadyDoneBases.add(outputbase)
     domtableFilesUnprocessed = domtableFiles - alreadyDone
     if len(domtableFilesUnprocessed) == 0: # Re-run
         print(" All domtable files had already been processed")
@@ -2529,22 +2684,22 @@ if __name__=="__main__":
     else: # First run
         print(" Processing {} domtable files".format(str(len(domtableFiles))))
 
-    # If using the multiprocessing version and outputbase doesn't have any
-    #  predicted domains, it's not as easy to remove if from the analysis
-    #  (probably because parseHmmScan only has a copy of clusters et al?)
-    # Using serialized version for now. Probably doesn't have too bad an impact
-    #pool = Pool(cores,maxtasksperchild=32)
-    for domtableFile in domtableFiles - alreadyDone:
-        parseHmmScan(domtableFile, pfd_folder, pfs_folder, options.domain_overlap_cutoff)
-        #pool.apply_async(parseHmmScan, args=(domtableFile,output_folder,options.domain_overlap_cutoff))
-    #pool.close()
-    #pool.join()
+    # Workers only get a copy of clusters et al., so they report back which
+    #  BGCs had no predicted domains and these are removed here
+    if len(domtableFilesUnprocessed) > 0:
+        pool = get_context("fork").Pool(cores, maxtasksperchild=100)
+        parse_results = pool.starmap(parseHmmScan, [(domtableFile, pfd_folder, pfs_folder, options.domain_overlap_cutoff) for domtableFile in sorted(domtableFilesUnprocessed)], 8)
+        pool.close()
+        pool.join()
+        for outputbase, has_domains in parse_results:
+            if not has_domains:
+                remove_domainless_bgc(outputbase)
     
     # If number of pfd files did not change, no new sequences were added to the 
     #  domain fastas and we could try to resume the multiple alignment phase
     # baseNames have been pruned of BGCs with no domains that might've been added temporarily
     try_MA_resume = False
-    if len(baseNames - set(pfd.split(os.sep)[-1][:-9] for pfd in alreadyDone)) == 0:
+    if len(baseNames - alreadyDoneBases) == 0:
         try_MA_resume = True
     else:
         # new sequences will be added to the domain fasta files. Clean domains folder
@@ -2562,13 +2717,11 @@ if __name__=="__main__":
     print("\nProcessing domains sequence files")
     
     # All available pfd files
-    allPfdFiles = set(glob(os.path.join(pfd_folder,"*.pfd")))
+    allPfdFiles = set(list_files(pfd_folder, ".pfd"))
     
     # pfdFiles: all pfd files corresponding to the input files
     # (some input files could've been removed due to not having predicted domains)
-    pfdFiles = set()
-    for name in baseNames:
-        pfdFiles.add(os.path.join(pfd_folder, name+".pfd"))
+    pfdFiles = {pfd_prefix + name + ".pfd" for name in baseNames}
     
     # pfdBases: the actual set of input files that have pfd files
     pfdBases = allPfdFiles.intersection(pfdFiles)
@@ -2579,12 +2732,14 @@ if __name__=="__main__":
         sys.exit("Error! The following files did NOT have their domtable files processed: " + ", ".join(pfdFiles - pfdBases))
 
     filtered_matrix = []
+    # Key: BGC. Item: number of domains per orf tag, counted while the pfd file
+    # is already open so it doesn't need to be read again below
+    pfd_orf_domain_counts = {}
     if options.skip_ma:
         print(" Running with skip_ma parameter: Assuming that the domains folder has all the fasta files")
         try:
-            with open(os.path.join(cache_folder, "BGCs.dict"), "r") as BGC_file:
+            with open(os.path.join(cache_folder, "BGCs.dict"), "rb") as BGC_file:
                 BGCs = pickle.load(BGC_file)
-                BGC_file.close()
         except IOError:
             sys.exit("BGCs file not found...")
     else:
@@ -2594,13 +2749,12 @@ if __name__=="__main__":
             if verbose:
                 print("   Processing: " + outputbase)
 
-            pfdFile = os.path.join(pfd_folder, outputbase + ".pfd")
-            with open(pfdFile) as pfd_handle:
+            with open(pfd_prefix + outputbase + ".pfd") as pfd_handle:
                 filtered_matrix = [[part.strip() for part in line.split('\t')] 
                     for line in pfd_handle]
 
             # save each domain sequence from a single BGC in its corresponding file
-            fasta_file = os.path.join(bgc_fasta_folder, outputbase + ".fasta")
+            fasta_file = fasta_prefix + outputbase + ".fasta"
 
             # only create domain fasta if the pfd content is different from original and 
             #  domains folder has been emptied. Else, if trying to resume alignment phase,
@@ -2611,31 +2765,31 @@ if __name__=="__main__":
                 save_domain_seqs(filtered_matrix, fasta_dict, domains_folder, outputbase)
 
             BGCs[outputbase] = BGC_dic_gen(filtered_matrix)
+            pfd_orf_domain_counts[outputbase] = Counter(row[-1] for row in filtered_matrix)
             
             del filtered_matrix[:]
             
         # store processed BGCs dictionary for future re-runs
         with open(os.path.join(cache_folder, "BGCs.dict"), "wb") as BGC_file:
-            pickle.dump(BGCs, BGC_file)
-            BGC_file.close()
+            pickle.dump(BGCs, BGC_file, protocol=pickle.HIGHEST_PROTOCOL)
             
     # if it's a re-run, the pfd/pfs files were not changed, so the skip_ma flag
     # is activated. We have to open the pfd files to get the gene labels for
     # each domain
     # We now always have to have this data so the alignments are produced
-    pfd_dict_domains = defaultdict(int)
     orf_keys = {}
     for outputbase in baseNames:
         DomainCountGene[outputbase] = array('B')
         corebiosynthetic_position[outputbase] = array('H')
         BGCGeneOrientation[outputbase] = array('b')
-        pfdFile = os.path.join(pfd_folder, outputbase + ".pfd")
+        pfdFile = pfd_prefix + outputbase + ".pfd"
         
         #pfd_dict_domains contains the number of domains annotated in the
         # pfd file for each orf tag
-        with open(pfdFile,"r") as pfdf:
-            for line in pfdf:
-                pfd_dict_domains[line.strip().split("\t")[-1]] += 1
+        pfd_dict_domains = pfd_orf_domain_counts.pop(outputbase, None)
+        if pfd_dict_domains is None:
+            with open(pfdFile,"r") as pfdf:
+                pfd_dict_domains = Counter(line.strip().split("\t")[-1] for line in pfdf)
         
         # extract the orf number from the tag and use it to traverse the BGC
         for orf in pfd_dict_domains.keys():
@@ -2656,7 +2810,6 @@ if __name__=="__main__":
                 corebiosynthetic_position[outputbase].append(orf_num)
             orf_num += 1
         
-        pfd_dict_domains.clear()
         orf_keys.clear()
 
         ## TODO: if len(corebiosynthetic_position[outputbase]) == 0
@@ -2673,6 +2826,8 @@ if __name__=="__main__":
         pfsfile = os.path.join(pfs_folder, outputbase + ".pfs")
         if os.path.isfile(pfsfile):
             DomainList[outputbase] = get_domain_list(pfsfile)
+            DomainSet[outputbase] = frozenset(DomainList[outputbase])
+            DomainPairSet[outputbase] = frozenset(get_adjacent_domain_pairs(DomainList[outputbase]))
         else:
             sys.exit(" Error: could not open " + outputbase + ".pfs")
                 
@@ -2682,35 +2837,14 @@ if __name__=="__main__":
     
     # read hmm file. We'll need that info anyway for final visualization
     print("  Parsing hmm file for domain information")
-    pfam_info = {}
-    name = ""
-    acc = "" # compulsory line
-    desc = ""
-    with open(os.path.join(pfam_dir, "Pfam-A.hmm"), "r") as pfam:
-        for line in pfam:
-            if line.strip() == "//":
-                # found new record
-                if acc: pfam_info[acc] = (name, desc)
-
-                # clear data in any case
-                name = ""
-                acc = "" # compulsory line
-                desc = ""
-
-                continue
-
-            if line[:4] not in {"NAME", "ACC ", "DESC"}: continue
-
-            if line[:4] == "NAME": name = line.strip()[6:]
-            elif line[:3] == "ACC": acc = line.strip()[6:].split(".")[0]
-            elif line[:4] == "DESC": desc = line.strip()[6:]
+    pfam_info = get_pfam_info(os.path.join(pfam_dir, "Pfam-A.hmm"))
     print("    Done")
     
     # verify if there are figures already generated
     
     # All available SVG files
     availableSVGs = set()
-    for svg in glob(os.path.join(svg_folder,"*.svg")):
+    for svg in list_files(svg_folder, ".svg"):
         (root, ext) = os.path.splitext(svg)
         availableSVGs.add(root.split(os.sep)[-1])
         
@@ -2746,12 +2880,12 @@ if __name__=="__main__":
         print("Performing multiple alignment of domain sequences")
         
         # obtain all fasta files with domain sequences
-        domain_sequence_list = set(glob(os.path.join(domains_folder,"*.fasta")))
+        domain_sequence_list = set(list_files(domains_folder, ".fasta"))
         
         # compare with .algn set of files. Maybe resuming is possible if
         # no new sequences were added
         if try_MA_resume:
-            temp_aligned = set(glob(os.path.join(domains_folder, "*.algn")))
+            temp_aligned = set(list_files(domains_folder, ".algn"))
             
             if len(temp_aligned) > 0:
                 print(" Found domain fasta files without corresponding alignments")
@@ -2809,17 +2943,44 @@ if __name__=="__main__":
     
     # If there's something to analyze, load the aligned sequences
     print(" Trying to read domain alignments (*.algn files)")
-    aligned_files_list = glob(os.path.join(domains_folder, "*.algn"))
+    aligned_files_list = list_files(domains_folder, ".algn")
     if len(aligned_files_list) == 0:
         sys.exit("No aligned sequences found in the domain folder (run without the --skip_ma parameter or point to the correct output folder)")
+    aligned_domain_row = {} # Key: specific domain sequence label. Item: row in its domain's array
     for aligned_file in aligned_files_list:
-        with open(aligned_file, "r") as aligned_file_handle:
-            fasta_dict = fasta_parser(aligned_file_handle)
-            for header in fasta_dict:
-                AlignedDomainSequences[header] = fasta_dict[header]
+        domain = os.path.basename(aligned_file)[:-5]
+        headers, aligned_seqs = read_alignment(aligned_file)
+        if len(headers) == 0:
+            continue
+            
+        # Sequences *should* be of the same length unless something went
+        # wrong elsewhere
+        if len(set(len(seq) for seq in aligned_seqs)) > 1:
+            print("\tWARNING: mismatch in sequences' lengths in alignment {}".format(aligned_file))
+            for header, seq in zip(headers, aligned_seqs):
+                print("\t  Specific domain: {} len: {}".format(header, str(len(seq))))
+                
+        AlignedDomainArrays[domain] = aligned_sequences_array(aligned_seqs)
+        for row, header in enumerate(headers):
+            aligned_domain_row[header] = row
+
+    # Keep the rows of each BGC's domain copies as index arrays, so pairwise
+    # comparisons slice them directly instead of looking up every label.
+    # Domains present in a single BGC are never aligned nor compared
+    for bgc in clusters:
+        DomainRows[bgc] = {domain: np.array([aligned_domain_row[tag] for tag in specific_domain_list], dtype=np.intp)
+            for domain, specific_domain_list in BGCs[bgc].items() if domain in AlignedDomainArrays}
+    aligned_domain_row.clear()
 
     clusterNames = tuple(sorted(clusters))
     
+    # Key: (cluster1_index, cluster2_index). Item: [number of later networks
+    # that will use it, network row, raw values]. Only the distance depends
+    # on the class weights, so rows can be re-used by later networks (see
+    # generate_network)
+    network_row_cache = {}
+    pending_bgc_classes = defaultdict(set)
+    
     # we have to find the idx of query_bgc
     if has_query_bgc:
         try:
@@ -2832,7 +2993,7 @@ if __name__=="__main__":
     create_directory(network_files_folder, "Network Files", False)
 
     # copy html templates
-    dir_util.copy_tree(os.path.join(os.path.dirname(os.path.realpath(__file__)), "html_template", "output"), output_folder)
+    shutil.copytree(os.path.join(os.path.dirname(os.path.realpath(__file__)), "html_template", "output"), output_folder, dirs_exist_ok=True)
 
     # make a new run folder in the html output & copy the overview_html
     network_html_folder = os.path.join(output_folder, "html_content", "networks", run_name)
@@ -2884,6 +3045,70 @@ if __name__=="__main__":
         for bgc in mibig_set:
             mibig_set_indices.add(name_to_idx[bgc])
 
+    # Preparing gene cluster classes. Done before the mix network so that we
+    # know which of its rows will be needed again by the class networks
+    BGC_classes = defaultdict(list)
+    if options_classify:
+        print("\n Sorting the input BGCs")
+        
+        # create and sort working set for each class
+        for clusterIdx,clusterName in enumerate(clusterNames):
+            if has_includelist:
+                # extra processing because pfs info includes model version
+                bgc_domain_set = set({x.split(".")[0] for x in DomainList[clusterName]})
+                    
+                if len(domain_includelist & bgc_domain_set) == 0:
+                    continue
+            
+            product = bgc_info[clusterName].product
+            predicted_class = sort_bgc(product)
+            
+            if predicted_class.lower() in valid_classes:
+                BGC_classes[predicted_class].append(clusterIdx)
+            
+            # possibly add hybrids to 'pure' classes
+            if options.hybrids:
+                if predicted_class == "PKS-NRP_Hybrids":
+                    if "nrps" in valid_classes:
+                        BGC_classes["NRPS"].append(clusterIdx)
+                    if "t1pks" in product and "pksi" in valid_classes:
+                        BGC_classes["PKSI"].append(clusterIdx)
+                    if "t1pks" not in product and "pksother" in valid_classes:
+                        BGC_classes["PKSother"].append(clusterIdx)
+                
+                if predicted_class == "Others" and "." in product:
+                    subclasses = set()
+                    for subproduct in product.split("."):
+                        subclass = sort_bgc(subproduct)
+                        if subclass.lower() in valid_classes:
+                            subclasses.add(subclass)
+                            
+                    # Prevent mixed BGCs with sub-Others annotations to get
+                    # added twice (e.g. indole-cf_fatty_acid has already gone
+                    # to Others at this point)
+                    if "Others" in subclasses:
+                        subclasses.remove("Others")
+                        
+                        
+                    for subclass in subclasses:
+                        BGC_classes[subclass].append(clusterIdx)
+                    subclasses.clear()
+
+    # Key: BGC index. Item: classes with the BGC whose network has not been
+    # generated yet. Used to know which rows are worth keeping in 
+    # network_row_cache (see generate_network). Classes that will be skipped
+    # below are left out
+    for bgc_class in BGC_classes:
+        bgcs = BGC_classes[bgc_class]
+        if has_query_bgc and query_bgc_idx not in bgcs:
+            continue
+        if use_relevant_mibig and len(set(bgcs) & mibig_set_indices) == len(bgcs):
+            continue
+        if len(bgcs) < 2 and not has_query_bgc:
+            continue
+        for bgc in bgcs:
+            pending_bgc_classes[bgc].add(bgc_class)
+    
     # Making network files mixing all classes
     if options_mix:
         print("\n Mixing all BGC classes")
@@ -2912,14 +3137,13 @@ if __name__=="__main__":
         create_directory(os.path.join(network_files_folder, "mix"), "  Mix", False)
         
         print("  Calculating all pairwise distances")
+        # mix_set is sorted and has no repeated BGCs, so pairs come out as 
+        # unique ordered tuples
         if has_query_bgc:
-            pairs = set([tuple(sorted(combo)) for combo in combinations_product([query_bgc_idx], mix_set)])
+            cluster_pairs = [(query_bgc_idx, y, -1) if query_bgc_idx < y else (y, query_bgc_idx, -1) for y in mix_set]
         else:
-            # convert into a set of ordered tuples
-            pairs = set([tuple(sorted(combo)) for combo in combinations(mix_set, 2)])
+            cluster_pairs = [(x, y, -1) for (x, y) in combinations(mix_set, 2)]
         
-        cluster_pairs = [(x, y, -1) for (x, y) in pairs]
-        pairs.clear()
         network_matrix_mix = generate_network(cluster_pairs, cores)
         
         del cluster_pairs[:]
@@ -2928,30 +3152,26 @@ if __name__=="__main__":
         if has_query_bgc:
             new_set = []
             
-            # rows from the distance matrix that will be pruned 
-            del_list = [] 
-        
-            for idx, row in enumerate(network_matrix_mix):
+            # rows from the distance matrix that will be kept
+            kept_rows = []
+            
+            for row in network_matrix_mix:
                 a, b, distance = int(row[0]), int(row[1]), row[2]
                 
                 if a == b:
+                    kept_rows.append(row)
                     continue
                 
                 if distance <= max_cutoff:
+                    kept_rows.append(row)
                     if a == query_bgc_idx:
                         new_set.append(b)
                     else:
                         new_set.append(a)
-                else:
-                    del_list.append(idx)
-            
-            for idx in sorted(del_list, reverse=True):
-                del network_matrix_mix[idx]
-            del del_list[:]
             
-            pairs = set([tuple(sorted(combo)) for combo in combinations(new_set, 2)])
-            cluster_pairs = [(x, y, -1) for (x, y) in pairs]
-            pairs.clear()
+            network_matrix_mix = kept_rows
+
+            cluster_pairs = [(x, y, -1) for (x, y) in combinations(sorted(new_set), 2)]
             network_matrix_new_set = generate_network(cluster_pairs, cores)
             del cluster_pairs[:]
             
@@ -3001,19 +3221,14 @@ if __name__=="__main__":
                 network_matrix_set_del.append(idx)
                 
             # delete all edges between marked bgcs
-            for row_idx in sorted(network_matrix_set_del, reverse=True):
-                del network_matrix_mix[row_idx]
-            del network_matrix_set_del[:]
+            network_matrix_set_del = set(network_matrix_set_del)
+            network_matrix_mix = [row for idx, row in enumerate(network_matrix_mix) if idx not in network_matrix_set_del]
+            network_matrix_set_del.clear()
             
             print("   Removing {} non-relevant MIBiG BGCs".format(len(mibig_set_del)))
-            mix_set_idx = 0
-            bgc_to_mix_set_idx = {}
-            for idx, bgc in enumerate(mix_set):
-                bgc_to_mix_set_idx[bgc] = idx
-            
-            for bgc_idx in sorted(mibig_set_del, reverse=True):
-                del mix_set[bgc_to_mix_set_idx[bgc_idx]]
-            del mibig_set_del[:]
+            mibig_set_del = set(mibig_set_del)
+            mix_set = [bgc for bgc in mix_set if bgc not in mibig_set_del]
+            mibig_set_del.clear()
             
 
         print("  Writing output files")
@@ -3051,57 +3266,14 @@ if __name__=="__main__":
     if options_classify:
         print("\n Working for each BGC class")
         
-        # reinitialize BGC_classes to make sure the bgc lists are empty
-        BGC_classes = defaultdict(list)
-    
-        # Preparing gene cluster classes
-        print("  Sorting the input BGCs\n")
-        
-        # create and sort working set for each class
-        for clusterIdx,clusterName in enumerate(clusterNames):
-            if has_includelist:
-                # extra processing because pfs info includes model version
-                bgc_domain_set = set({x.split(".")[0] for x in DomainList[clusterName]})
-                    
-                if len(domain_includelist & bgc_domain_set) == 0:
-                    continue
-            
-            product = bgc_info[clusterName].product
-            predicted_class = sort_bgc(product)
-            
-            if predicted_class.lower() in valid_classes:
-                BGC_classes[predicted_class].append(clusterIdx)
-            
-            # possibly add hybrids to 'pure' classes
-            if options.hybrids:
-                if predicted_class == "PKS-NRP_Hybrids":
-                    if "nrps" in valid_classes:
-                        BGC_classes["NRPS"].append(clusterIdx)
-                    if "t1pks" in product and "pksi" in valid_classes:
-                        BGC_classes["PKSI"].append(clusterIdx)
-                    if "t1pks" not in product and "pksother" in valid_classes:
-                        BGC_classes["PKSother"].append(clusterIdx)
-                
-                if predicted_class == "Others" and "." in product:
-                    subclasses = set()
-                    for subproduct in product.split("."):
-                        subclass = sort_bgc(subproduct)
-                        if subclass.lower() in valid_classes:
-                            subclasses.add(subclass)
-                            
-                    # Prevent mixed BGCs with sub-Others annotations to get
-                    # added twice (e.g. indole-cf_fatty_acid has already gone
-                    # to Others at this point)
-                    if "Others" in subclasses:
-                        subclasses.remove("Others")
-                        
-                        
-                    for subclass in subclasses:
-                        BGC_classes[subclass].append(clusterIdx)
-                    subclasses.clear()
-
         # only make folders for the BGC_classes that are found
         for bgc_class in BGC_classes:
+            evict_network_rows()
+            
+            # rows calculated from now on are only cached for later classes
+            for bgc in BGC_classes[bgc_class]:
+                pending_bgc_classes[bgc].discard(bgc_class)
+            
             if has_query_bgc:
                 # not interested in this class if our Query BGC is not here...
                 if query_bgc_idx not in BGC_classes[bgc_class]:
@@ -3128,14 +3300,21 @@ if __name__=="__main__":
                     product = bgc_info[bgc].product
                     network_annotation_file.write("\t".join([bgc, bgc_info[bgc].accession_id, bgc_info[bgc].description, product, sort_bgc(product), bgc_info[bgc].organism, bgc_info[bgc].taxonomy]) + "\n")
             
+            # no network files are written for classes with a single BGC (see
+            # below), so don't go through the distance calculation either.
+            # (In query mode the QueryBGC annotation file is still written)
+            if len(BGC_classes[bgc_class]) < 2 and not has_query_bgc:
+                continue
+            
             print("   Calculating all pairwise distances")
+            # BGC_classes[bgc_class] is sorted and has no repeated BGCs, so 
+            # pairs come out as unique ordered tuples
+            class_idx = bgcClassName2idx[bgc_class]
             if has_query_bgc:
-                pairs = set([tuple(sorted(combo)) for combo in combinations_product([query_bgc_idx],BGC_classes[bgc_class])])
+                cluster_pairs = [(query_bgc_idx, y, class_idx) if query_bgc_idx < y else (y, query_bgc_idx, class_idx) for y in BGC_classes[bgc_class]]
             else:
-                pairs = set([tuple(sorted(combo)) for combo in combinations(BGC_classes[bgc_class], 2)])
+                cluster_pairs = [(x, y, class_idx) for (x, y) in combinations(BGC_classes[bgc_class], 2)]
                 
-            cluster_pairs = [(x, y, bgcClassName2idx[bgc_class]) for (x, y) in pairs]
-            pairs.clear()
             network_matrix = generate_network(cluster_pairs, cores)
             #pickle.dump(network_matrix,open("others.ntwrk",'wb'))
             del cluster_pairs[:]
@@ -3145,31 +3324,27 @@ if __name__=="__main__":
             if has_query_bgc:
                 new_set = []
                 
-                # rows from the distance matrix that will be pruned 
-                del_list = []
+                # rows from the distance matrix that will be kept
+                kept_rows = []
                 
-                for idx, row in enumerate(network_matrix):
+                for row in network_matrix:
                     a, b, distance = int(row[0]), int(row[1]), row[2]
                     
                     # avoid QBGC-QBGC
                     if a == b:
+                        kept_rows.append(row)
                         continue
                     
                     if distance <= max_cutoff:
+                        kept_rows.append(row)
                         if a == query_bgc_idx:
                             new_set.append(b)
                         else:
                             new_set.append(a)
-                    else:
-                        del_list.append(idx)
-                
-                for idx in sorted(del_list, reverse=True):
-                    del network_matrix[idx]
-                del del_list[:]
                 
-                pairs = set([tuple(sorted(combo)) for combo in combinations(new_set, 2)])
-                cluster_pairs = [(x, y, bgcClassName2idx[bgc_class]) for (x, y) in pairs]
-                pairs.clear()
+                network_matrix = kept_rows
+
+                cluster_pairs = [(x, y, class_idx) for (x, y) in combinations(sorted(new_set), 2)]
                 network_matrix_new_set = generate_network(cluster_pairs, cores)
                 del cluster_pairs[:]
                                     
@@ -3216,17 +3391,14 @@ if __name__=="__main__":
                     network_matrix_set_del.append(idx)
                 
                 # delete all edges between marked bgcs
-                for row_idx in sorted(network_matrix_set_del, reverse=True):
-                    del network_matrix[row_idx]
-                del network_matrix_set_del[:]
+                network_matrix_set_del = set(network_matrix_set_del)
+                network_matrix = [row for idx, row in enumerate(network_matrix) if idx not in network_matrix_set_del]
+                network_matrix_set_del.clear()
                             
                 print("   Removing {} non-relevant MIBiG BGCs".format(len(mibig_set_del)))
-                bgc_to_class_idx = {}
-                for idx, bgc in enumerate(BGC_classes[bgc_class]):
-                    bgc_to_class_idx[bgc] = idx
-                for bgc_idx in sorted(mibig_set_del, reverse=True):
-                    del BGC_classes[bgc_class][bgc_to_class_idx[bgc_idx]]
-                del mibig_set_del[:]
+                mibig_set_del = set(mibig_set_del)
+                BGC_classes[bgc_class] = [bgc for bgc in BGC_classes[bgc_class] if bgc not in mibig_set_del]
+                mibig_set_del.clear()
                     
                 
                 
@@ -3265,6 +3437,9 @@ if __name__=="__main__":
                     html_subs_per_run[network_html_folder_cutoff].append({ "name" : bgc_class, "css" : bgc_class, "label" : bgc_class})
             del BGC_classes[bgc_class][:]
             del reduced_network[:]
+            
+    network_row_cache.clear()
+    pending_bgc_classes.clear()
 
     # fetch genome list for overview.js
     genomes = []
@@ -21,29 +21,50 @@ Functions used by bigscape.py
 """
 
 import os
+import stat
 import sys
 import json
+import mmap
+from bisect import bisect_right
+from collections import defaultdict
+
+import numpy as np
 
 global verbose
 verbose = False
 
 
 def create_directory(path, kind, clean):
-    # TODO consider makedirs(path,exists_ok=True)
     try:
         os.makedirs(path)
+    except FileExistsError:
+        print(" " + kind + " folder already exists")
+        if clean:
+            print("  Cleaning folder")
+            for thing in os.listdir(path):
+                os.remove(os.path.join(path,thing))
     except OSError as e:
-        # 17 (Linux): "[Errno 17] File exists";
-        # 183 (Windows) "[Error 183] Cannot create a file when that file already exists"
-        if "Errno 17" in str(e) or "Error 183" in str(e):
-            print(" " + kind + " folder already exists")
-            if clean:
-                print("  Cleaning folder")
-                for thing in os.listdir(path):
-                    os.remove(os.path.join(path,thing))
-        else:
-            print("Error: unexpected error creating " + kind + " folder")
-            sys.exit(str(e))
+        print("Error: unexpected error creating " + kind + " folder")
+        sys.exit(str(e))
+
+
+def list_files(folder, extension):
+    """List the (non-hidden) files in folder with the given extension, e.g.
+    ".pfd". Like glob("*" + extension) but reading the folder in a single
+    scandir pass, as these (flat) folders can hold tens of thousands of files"""
+    with os.scandir(folder) as entries:
+        return [entry.path for entry in entries if entry.name.endswith(extension) 
+            and not entry.name.startswith(".") and entry.is_file()]
+
+
+def is_non_empty_file(path):
+    """Whether path is a regular file with some content. Same as
+    os.path.isfile(path) and os.path.getsize(path) > 0, with a single stat"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return stat.S_ISREG(st.st_mode) and st.st_size > 0
 
 
 def get_anchor_domains(filename):
@@ -80,35 +101,51 @@ def get_domain_list(filename):
     return domains
 
 
+def get_adjacent_domain_pairs(domains):
+    """Set of the unordered pairs of neighbouring domains in a list of domains,
+    each one stored as (smallest, largest). Used for the Adjacency Index"""
+    
+    pairs = set()
+    for x, y in zip(domains[:-1], domains[1:]):
+        pairs.add((x, y) if x < y else (y, x))
+        
+    return pairs
+
+
 def check_overlap(pfd_matrix, overlap_cutoff):
     """Check if domains overlap for a certain overlap_cutoff.
      If so, remove the domain(s) with the lower score."""
     
-    delete_list = []
-    for i in range(len(pfd_matrix)-1):
-        for j in range(i+1, len(pfd_matrix)):
-            row1 = pfd_matrix[i]
-            row2 = pfd_matrix[j]
-            
-            #check if we are the same CDS
-            if row1[-1] == row2[-1]:
-                #check if there is overlap between the domains
-                if no_overlap(int(row1[3]), int(row1[4]), int(row2[3]), int(row2[4])) == False:
-                    overlapping_aminoacids = overlap(int(row1[3]), int(row1[4]), int(row2[3]), int(row2[4]))
-                    overlap_perc_loc1 = overlap_perc(overlapping_aminoacids, int(row1[4])-int(row1[3]))
-                    overlap_perc_loc2 = overlap_perc(overlapping_aminoacids, int(row2[4])-int(row2[3]))
-                    #check if the amount of overlap is significant
-                    if overlap_perc_loc1 > overlap_cutoff or overlap_perc_loc2 > overlap_cutoff:
-                        if float(row1[1]) >= float(row2[1]): #see which has a better score
-                            delete_list.append(row2)
-                        elif float(row1[1]) < float(row2[1]):
-                            delete_list.append(row1)
-
-    for lst in delete_list:
-        try:
-            pfd_matrix.remove(lst)
-        except ValueError:
-            pass
+    # Only domains from the same CDS can overlap. Group them by CDS and sweep
+    # each group sorted by start coordinate: a domain only needs to be
+    # compared with the previous ones that have not ended yet
+    cds_domains = defaultdict(list)
+    for idx, row in enumerate(pfd_matrix):
+        cds_domains[row[-1]].append((row[3], row[4], row[1], idx))
+    
+    delete_set = set()
+    for domains in cds_domains.values():
+        domains.sort()
+        active = []
+        for domain2 in domains:
+            start2, end2, score2, idx2 = domain2
+            active = [domain1 for domain1 in active if domain1[1] >= start2]
+            for domain1 in active:
+                start1, end1, score1, idx1 = domain1
+                overlapping_aminoacids = overlap(start1, end1, start2, end2)
+                overlap_perc_loc1 = overlap_perc(overlapping_aminoacids, end1-start1)
+                overlap_perc_loc2 = overlap_perc(overlapping_aminoacids, end2-start2)
+                #check if the amount of overlap is significant
+                if overlap_perc_loc1 > overlap_cutoff or overlap_perc_loc2 > overlap_cutoff:
+                    # in case of a tie, keep the domain that was found first
+                    first, second = (domain1, domain2) if idx1 < idx2 else (domain2, domain1)
+                    if first[2] >= second[2]: #see which has a better score
+                        delete_set.add(second[3])
+                    else:
+                        delete_set.add(first[3])
+            active.append(domain2)
+    
+    pfd_matrix = [row for idx, row in enumerate(pfd_matrix) if idx not in delete_set]
         
     # for some reason, some coordinates in genbank files have ambiguous 
     # starting/ending positions for the CDS. In this case we need the 
@@ -123,8 +160,8 @@ def check_overlap(pfd_matrix, overlap_cutoff):
         
         loci_start = int(row[7])
         loci_end = int(row[8])
-        domain_start = int(row[3])
-        domain_end = int(row[4])
+        domain_start = row[3]
+        domain_end = row[4]
         
         # uses nucleotide coordinates for sorting
         width = 3*(domain_end - domain_start)
@@ -152,23 +189,9 @@ def check_overlap(pfd_matrix, overlap_cutoff):
                         
 
 def write_pfd(pfd_handle, matrix):
-    for row in matrix:
-        row = "\t".join(row)
-        pfd_handle.write(row+"\n")
-        
-    pfd_handle.close() 
+    pfd_handle.write("".join("\t".join(map(str, row)) + "\n" for row in matrix))
     
 
-def no_overlap(locA1, locA2, locB1, locB2):
-    """Return True if there is no overlap between two regions"""
-    if locA1 < locB1 and locA2 < locB1:
-        return True
-    elif locA1 > locB2 and locA2 > locB2:
-        return True
-    else:
-        return False
-
-
 def overlap_perc(overlap, len_seq):
     return float(overlap) / len_seq
     
@@ -216,15 +239,69 @@ def BGC_dic_gen(filtered_matrix):
     
 def save_domain_seqs(filtered_matrix, fasta_dict, domains_folder, outputbase):
     """Write fasta sequences for the domains in the right pfam-domain file"""
+    # group the sequences by domain so each domain file is opened only once
+    domain_records = defaultdict(list)
     for row in filtered_matrix:
-        domain = row[5]
         header = row[-1].strip()
         seq = fasta_dict[header] #access the sequence by using the header
-        
-        domain_file = open(os.path.join(domains_folder, domain + ".fasta"), 'a') #append to existing file
-        domain_file.write(">{}:{}:{}\n{}\n".format(header, row[3], row[4],
+        domain_records[row[5]].append(">{}:{}:{}\n{}\n".format(header, row[3], row[4],
             seq[int(row[3])-1:int(row[4])])) #only use the range of the pfam domain within the sequence
-        domain_file.close()
+        
+    for domain, records in domain_records.items():
+        with open(os.path.join(domains_folder, domain + ".fasta"), 'a') as domain_file: #append to existing file
+            domain_file.write("".join(records))
+
+
+def read_alignment(filename):
+    """Reads an aligned fasta file (.algn) in one go. Returns the list of 
+    headers and the list of aligned sequences (as bytes), in file order"""
+    
+    with open(filename, "rb") as handle:
+        data = handle.read()
+        
+    headers = []
+    aligned_seqs = []
+    for record in (b"\n" + data).split(b"\n>")[1:]:
+        header, _, seq = record.partition(b"\n")
+        headers.append(header.strip().decode())
+        aligned_seqs.append(b"".join(seq.split()))
+        
+    return headers, aligned_seqs
+
+
+def aligned_sequences_array(aligned_seqs):
+    """Stack a list of aligned sequences (bytes) as the rows of a 2D uint8
+    numpy array. Sequences from the same alignment should all have the same 
+    length; if not, they are truncated to the shortest one (only the positions
+    present in all sequences can be compared)"""
+    
+    seq_length = min(len(seq) for seq in aligned_seqs)
+    return np.frombuffer(b"".join(seq[:seq_length] for seq in aligned_seqs), 
+        dtype=np.uint8).reshape(len(aligned_seqs), seq_length)
+
+
+def calc_distance_matrix(seqs_a, seqs_b):
+    """Distance (1 - sequence identity) between every pair of aligned domain
+    sequences from two 2D uint8 arrays (one sequence per row, see 
+    aligned_sequences_array). Returns a len(seqs_a) x len(seqs_b) numpy array.
+    Positions where both sequences have a gap are not taken into account"""
+
+    seq_length = seqs_a.shape[1]
+    
+    # compare every copy in A with every copy in B, position by position. 
+    # Copies of A are taken in blocks so the comparison array stays small 
+    # (~16MB at most) even for domains with many copies.
+    # Positions where both have a gap are counted with a single matrix 
+    # product of the gap masks
+    block_size = max(1, (1 << 24) // max(1, len(seqs_b) * seq_length))
+    same = np.empty((len(seqs_a), len(seqs_b)), dtype=np.intp)
+    for start in range(0, len(seqs_a), block_size):
+        same[start:start+block_size] = np.count_nonzero(
+            seqs_a[start:start+block_size, None, :] == seqs_b[None, :, :], axis=2)
+    gaps = (seqs_a == ord("-")).astype(np.int32) @ (seqs_b == ord("-")).astype(np.int32).T
+    matches = same - gaps
+    
+    return 1 - matches/(seq_length-gaps)
 
 
 def write_network_matrix(matrix, cutoffs_and_filenames, include_singletons, clusterNames, bgc_info):
@@ -245,16 +322,29 @@ def write_network_matrix(matrix, cutoffs_and_filenames, include_singletons, clus
         networkfiles[cutoff] = open(filename, "w")
         networkfiles[cutoff].write("Clustername 1\tClustername 2\tRaw distance\tSquared similarity\tJaccard index\tDSS index\tAdjacency index\traw DSS non-anchor\traw DSS anchor\tNon-anchor domains\tAnchor domains\tCombined group\tShared group\n")
       
-    #Dictionaries to keep track of connected nodes, to know which are singletons
-    clusterSetAllDict = {}
-    clusterSetConnectedDict = {}
-    for cutoff in cutoffs:
-        clusterSetAllDict[cutoff] = set()
-        clusterSetConnectedDict[cutoff] = set()
+    # A row goes to the files of all the cutoffs above its distance: with the
+    # cutoffs sorted, these are found with a single bisection
+    sortedCutoffs = sorted(cutoffs)
+    sortedNetworkfiles = [networkfiles[cutoff] for cutoff in sortedCutoffs]
+    
+    # Shortest distance of each node to any other. A node is a singleton
+    # for every cutoff that is not above it
+    minDistance = {}
 
     for matrix_entry in matrix:
         gc1 = clusterNames[int(matrix_entry[0])]
         gc2 = clusterNames[int(matrix_entry[1])]
+        distance = matrix_entry[2]
+        
+        if gc1 not in minDistance or distance < minDistance[gc1]:
+            minDistance[gc1] = distance
+        if gc2 not in minDistance or distance < minDistance[gc2]:
+            minDistance[gc2] = distance
+        
+        firstCutoff = bisect_right(sortedCutoffs, distance)
+        if firstCutoff == len(sortedCutoffs):
+            continue
+        
         row = [gc1, gc2]
         
         # get AntiSMASH annotations
@@ -270,7 +360,7 @@ def write_network_matrix(matrix, cutoffs_and_filenames, include_singletons, clus
 
         # prepare combined group
         if clus1group != "" and clus2group != "": #group1, group2
-            row.append(" - ".join(sorted([clus1group,clus2group])))
+            row.append(clus1group + " - " + clus2group if clus1group < clus2group else clus2group + " - " + clus1group)
         elif clus2group != "":
             row.append(clus2group)
         elif clus1group != "":
@@ -284,21 +374,17 @@ def write_network_matrix(matrix, cutoffs_and_filenames, include_singletons, clus
         else:
             row.append("")
 
-        for cutoff in cutoffs:
-            clusterSetAllDict[cutoff].add(gc1)
-            clusterSetAllDict[cutoff].add(gc2)
-            
-            if row[2] < cutoff:
-                clusterSetConnectedDict[cutoff].add(gc1)
-                clusterSetConnectedDict[cutoff].add(gc2)
-                
-                networkfiles[cutoff].write("\t".join(map(str,row)) + "\n")
+        line = "\t".join(map(str,row)) + "\n"
+        for networkfile in sortedNetworkfiles[firstCutoff:]:
+            networkfile.write(line)
 
 
     #Add the nodes without any edges, give them an edge to themselves with a distance of 0
     if include_singletons == True:
         for cutoff in cutoffs:
-            for gc in clusterSetAllDict[cutoff]-clusterSetConnectedDict[cutoff]:
+            for gc, distance in minDistance.items():
+                if distance < cutoff:
+                    continue
                 #Arbitrary numbers for S and Sa domains: 1 of each (logical would be 0,0 but 
                 # that could mess re-analysis with divisions-by-zero;
                 networkfiles[cutoff].write("\t".join([gc, gc, "0", "1", "1", "1", "1", "0", "0", "1", "1", "", ""]) + "\n")
@@ -312,6 +398,7 @@ def fasta_parser(handle):
     """Parses a fasta file, and stores it in a dictionary.
     Only works if there are no duplicate fasta headers in the fasta file"""
     
+    # collect the sequence lines of each entry and join them only once
     fasta_dict = {}
     header = ""
     for line in handle:
@@ -319,10 +406,13 @@ def fasta_parser(handle):
             header=line.strip()[1:]
         else:
             try:
-                fasta_dict[header] += line.strip()
+                fasta_dict[header].append(line.strip())
             except KeyError:
-                fasta_dict[header] = line.strip()
+                fasta_dict[header] = [line.strip()]
 
+    for header in fasta_dict:
+        fasta_dict[header] = "".join(fasta_dict[header])
+        
     return fasta_dict
 
 
@@ -347,6 +437,7 @@ def domtable_parser(gbk, dom_file):
 #Lycopene_cycl        PF05834.8    378 loc:[0:960](-):gid::pid::loc_tag:['ctg363_1'] -            320   3.1e-38  131.7   0.0   1   1   1.1e-40   1.8e-36  126.0   0.0     7   285    33   295    31   312 0.87 Lycopene cyclase protein
     
 #pfd_matrix columns: gbk filename - score - gene id - first coordinate - second coordinate - pfam id - domain name -start coordinate of gene - end coordinate of gene - cds header
+# (the score is kept as a float and the domain coordinates as ints)
     
     pfd_matrix = []
     try:
@@ -360,7 +451,7 @@ def domtable_parser(gbk, dom_file):
                 pfd_row = []
                 pfd_row.append(gbk)         #add clustername or gbk filename
                 
-                pfd_row.append(splitline[13]) #add the score
+                pfd_row.append(float(splitline[13])) #add the score
 
                 header_list = splitline[3].split(":")
                 try:
@@ -369,8 +460,8 @@ def domtable_parser(gbk, dom_file):
                     print("No gene ID in " + gbk)
                     pfd_row.append('')
                     
-                pfd_row.append(splitline[19])#first coordinate, env coord from
-                pfd_row.append(splitline[20])#second coordinate, env coord to
+                pfd_row.append(int(splitline[19]))#first coordinate, env coord from
+                pfd_row.append(int(splitline[20]))#second coordinate, env coord to
                 
                 #===================================================================
                 # loc_split = header_list[2].split("]") #second coordinate (of CDS) and the direction
@@ -482,6 +573,38 @@ def write_parameters(output_folder, parameters):
  
 
 
+def get_pfam_info(hmm_file):
+    """Read the name and description of every Pfam model (key: accession, 
+    without version) from the Pfam-A.hmm file.
+    Only the header lines of each model are read: from NAME to LENG, which
+    are always at the beginning of each record (in that order). The rest of 
+    the (large) file is skipped with mmap searches instead of being read line 
+    by line"""
+    
+    pfam_info = {}
+    with open(hmm_file, "rb") as pfam, mmap.mmap(pfam.fileno(), 0, access=mmap.ACCESS_READ) as hmm:
+        start = hmm.find(b"NAME ")
+        while start != -1:
+            end = hmm.find(b"\nLENG ", start)
+            if end == -1:
+                end = hmm.find(b"\n//", start)
+                
+            name = ""
+            acc = "" # compulsory line
+            desc = ""
+            for line in hmm[start:end].decode().split("\n"):
+                if line[:4] == "NAME": name = line.strip()[6:]
+                elif line[:4] == "ACC ": acc = line.strip()[6:].split(".")[0]
+                elif line[:4] == "DESC": desc = line.strip()[6:]
+            if acc: pfam_info[acc] = (name, desc)
+            
+            start = hmm.find(b"\nNAME ", end)
+            if start != -1:
+                start += 1
+                
+    return pfam_info
+
+
 def generatePfamColorsMatrix(pfam_domain_colors):
     '''
 
@@ -0,0 +1,32 @@
+"""calc_distance_matrix must give the same distances as comparing the aligned
+sequences position by position"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from functions import aligned_sequences_array, calc_distance_matrix
+
+
+def per_position_distance(seq_a, seq_b):
+    seq_length = min(len(seq_a), len(seq_b))
+    matches = 0
+    gaps = 0
+    for position in range(seq_length):
+        if seq_a[position] == seq_b[position]:
+            if seq_a[position] != ord("-"):
+                matches += 1
+            else:
+                gaps += 1
+    return 1 - (matches/(seq_length-gaps))
+
+
+def test_sequences_of_different_length():
+    seqs = [b"MK-LLV-A", b"MKALL--A", b"M--LIVGAST"]
+    seqs_array = aligned_sequences_array(seqs)
+    assert seqs_array.shape == (3, 8)
+    
+    distances = calc_distance_matrix(seqs_array[:1], seqs_array[1:])
+    for b in range(2):
+        assert abs(distances[0][b] - per_position_distance(seqs[0], seqs[b+1])) < 1e-12
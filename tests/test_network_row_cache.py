@@ -0,0 +1,84 @@
+"""Rows re-used from network_row_cache must match rows calculated from scratch"""
+
+import os
+import sys
+from array import array
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bigscape
+
+
+def setup_unrelated_pair(monkeypatch, tmp_path):
+    # two BGCs without any shared domain, both with anchor and non-anchor
+    # domains so that the anchorboost is used (S = 2, S anchor = 3: the 
+    # combined raw DSS is not exactly 1 for this proportion)
+    domains = {
+        "BGC_A": ["PF00109.25", "PF00550.24", "PF02801.21"],
+        "BGC_B": ["PF00501.27", "PF00668.19"],
+    }
+    monkeypatch.setattr(bigscape, "log_folder", str(tmp_path), raising=False)
+    monkeypatch.setattr(bigscape, "clusterNames", ("BGC_A", "BGC_B"), raising=False)
+    monkeypatch.setattr(bigscape, "bgcClassNames", ("Terpene", "mix"), raising=False)
+    monkeypatch.setattr(bigscape, "bgc_class_weight", {
+        "Terpene": (0.2, 0.75, 0.05, 2.0),
+        "mix": (0.2, 0.75, 0.05, 2.0)}, raising=False)
+    monkeypatch.setattr(bigscape, "anchor_domains", {"PF00109", "PF00501", "PF00668"}, raising=False)
+    monkeypatch.setattr(bigscape, "DomainList", domains, raising=False)
+    monkeypatch.setattr(bigscape, "DomainSet", 
+        {bgc: frozenset(domains[bgc]) for bgc in domains}, raising=False)
+    monkeypatch.setattr(bigscape, "BGCs", 
+        {bgc: {dom: ["{}_{}".format(bgc, dom)] for dom in domains[bgc]} for bgc in domains}, raising=False)
+    monkeypatch.setattr(bigscape, "DomainCountGene", 
+        {bgc: array('B', [1, 2]) for bgc in domains}, raising=False)
+    monkeypatch.setattr(bigscape, "corebiosynthetic_position", 
+        {bgc: array('B', [0]) for bgc in domains}, raising=False)
+    monkeypatch.setattr(bigscape, "BGCGeneOrientation", 
+        {bgc: array('b', [1, 1]) for bgc in domains}, raising=False)
+    monkeypatch.setattr(bigscape, "network_row_cache", {}, raising=False)
+    monkeypatch.setattr(bigscape, "pending_bgc_classes", defaultdict(set), raising=False)
+
+
+def test_reused_row_of_unrelated_pair(monkeypatch, tmp_path):
+    setup_unrelated_pair(monkeypatch, tmp_path)
+    
+    # mix network first, with the Terpene network still to be generated
+    bigscape.pending_bgc_classes[0].add("Terpene")
+    bigscape.pending_bgc_classes[1].add("Terpene")
+    bigscape.generate_network([(0, 1, 1)], 1)
+    
+    bigscape.pending_bgc_classes[0].discard("Terpene")
+    bigscape.pending_bgc_classes[1].discard("Terpene")
+    reused = bigscape.generate_network([(0, 1, 0)], 1)
+    
+    bigscape.network_row_cache.clear()
+    fresh = bigscape.generate_network([(0, 1, 0)], 1)
+    
+    assert fresh[0][5] == 0.0
+    assert reused[0].tobytes() == fresh[0].tobytes()
+    assert len(bigscape.network_row_cache) == 0
+
+
+def test_rows_released_when_no_longer_needed(monkeypatch, tmp_path):
+    setup_unrelated_pair(monkeypatch, tmp_path)
+    raw = array('d', [0.5, 0.0, 0.25, 0.0, 2, 3, 0, 0, 2, 0])
+    bigscape.network_row_cache[(0, 1)] = raw
+    bigscape.pending_bgc_classes[0].add("Terpene")
+    bigscape.pending_bgc_classes[1].add("Terpene")
+    
+    # still needed by the Terpene network
+    bigscape.evict_network_rows()
+    assert (0, 1) in bigscape.network_row_cache
+    
+    # e.g. the Terpene network was skipped or did not use the pair
+    bigscape.pending_bgc_classes[1].discard("Terpene")
+    bigscape.evict_network_rows()
+    assert len(bigscape.network_row_cache) == 0
+    
+    # the last network that needs the row drops it when re-using it
+    bigscape.network_row_cache[(0, 1)] = raw
+    row = bigscape.reuse_network_row((0, 1), "Terpene")
+    assert len(bigscape.network_row_cache) == 0
+    assert row[:2].tolist() == [0, 1]
+    assert row[4] == 0.5